@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", os.path.expanduser("~/.cache/devopsproject-artifacts"))
+CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", str(4 * 1024**3)))
+
+
+def normalize_etag(etag):
+    return (etag or "").strip('"')
+
+
+class ArtifactCache:
+    # Local content-addressed store for bucket objects. An entry is keyed by the
+    # object's ETag and size, so a changed object (new ETag) is always a miss and
+    # an unchanged one is never downloaded twice. Least recently used entries are
+    # evicted once the cache grows past max_bytes.
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = self._load_index()
+        self.hits = 0
+        self.misses = 0
+        # Downloads run on a thread pool; the index is shared between them.
+        self._lock = threading.RLock()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Drop entries whose blob went missing (e.g. a partially cleaned cache dir).
+        return {k: v for k, v in index.items() if os.path.exists(self._blob_path(k))}
+
+    def _save_index(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _blob_path(self, key):
+        return os.path.join(self.objects_dir, key)
+
+    @staticmethod
+    def key(etag, size):
+        return hashlib.sha256(f"{normalize_etag(etag)}:{size}".encode()).hexdigest()
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def lookup(self, etag, size):
+        key = self.key(etag, size)
+        with self._lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.index[key]["last_used"] = time.time()
+            self._save_index()
+            return self._blob_path(key)
+
+    def temp_path(self):
+        # Downloads land next to the blobs so admitting them is a rename.
+        fd, path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        os.close(fd)
+        return path
+
+    def admit(self, etag, size, src_path, object_name=None):
+        key = self.key(etag, size)
+        with self._lock:
+            os.replace(src_path, self._blob_path(key))
+            self.index[key] = {
+                "etag": normalize_etag(etag),
+                "size": size,
+                "object_name": object_name,
+                "last_used": time.time(),
+            }
+            self._evict(keep=key)
+            self._save_index()
+            return self._blob_path(key)
+
+    def _evict(self, keep=None):
+        total = self.total_bytes()
+        for key, entry in sorted(self.index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._blob_path(key))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self.index[key]
+            print(f"[cache] Evicted {entry.get('object_name') or key} ({entry['size']} bytes)")
+
+
+def materialize(blob_path, local_path):
+    os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+    tmp_path = f"{local_path}.part"
+    shutil.copyfile(blob_path, tmp_path)
+    os.replace(tmp_path, local_path)
@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import time
+import logging
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from ingest import current_rss_mb, peak_rss_mb
+
+BENCH_ROWS = int(os.environ.get("BENCH_ROWS", "100000"))
+BENCH_REPEATS = int(os.environ.get("BENCH_REPEATS", "3"))
+BENCH_TRANSFER_MB = int(os.environ.get("BENCH_TRANSFER_MB", "64"))
+BENCH_HISTORY = os.environ.get("BENCH_HISTORY", "benchmark_logs/history.json")
+# A benchmark regresses when it is this much slower (or grows this much more
+# memory) than the median of the last BENCH_BASELINE_RUNS comparable runs.
+BENCH_TIME_TOLERANCE = float(os.environ.get("BENCH_TIME_TOLERANCE", "0.25"))
+BENCH_MEMORY_TOLERANCE = float(os.environ.get("BENCH_MEMORY_TOLERANCE", "0.25"))
+BENCH_MEMORY_SLACK_MB = 8.0
+BENCH_BASELINE_RUNS = 5
+REGRESSION_EXIT_CODE = 3
+
+SEQ_LEN = 24
+HORIZON = 6
+BATCH_SIZE = 32
+BUCKET_NAME = "benchmark"
+
+TARGETS = [
+    "temperature", "feels_like", "humidity", "wind_speed", "gust_speed", "pressure", "precipitation",
+    "rain_probability", "snow_probability", "uv_index", "dewpoint", "visibility", "cloud"
+]
+
+
+def synthetic_weather_frame(n_rows, seed=0):
+    # Hourly rows with a daily cycle, slow drift and noise, in the units and
+    # ranges of the real dataset, as float32 like read_weather_csv returns.
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_rows, dtype=np.float64)
+    day = np.sin(2 * np.pi * t / 24.0)
+    drift = np.cumsum(rng.normal(0, 0.05, n_rows))
+
+    temperature = 26 + 5 * day + drift + rng.normal(0, 0.5, n_rows)
+    humidity = np.clip(75 - 15 * day + rng.normal(0, 4, n_rows), 0, 100)
+    wind_speed = np.abs(10 + 4 * day + rng.normal(0, 3, n_rows))
+    rain_probability = np.clip(30 + 25 * np.sin(2 * np.pi * t / 24.0 + 2) + rng.normal(0, 10, n_rows), 0, 100)
+    cloud = np.clip(50 + 30 * np.sin(2 * np.pi * t / 72.0) + rng.normal(0, 10, n_rows), 0, 100)
+    frame = pd.DataFrame({
+        "temperature": temperature,
+        "feels_like": temperature + 0.1 * (humidity - 60) + rng.normal(0, 0.3, n_rows),
+        "humidity": humidity,
+        "wind_speed": wind_speed,
+        "gust_speed": wind_speed * 1.4 + np.abs(rng.normal(0, 2, n_rows)),
+        "pressure": 1010 + 3 * np.sin(2 * np.pi * t / 12.0) + 0.2 * drift,
+        "precipitation": np.where(rng.random(n_rows) < rain_probability / 400, rng.exponential(1.5, n_rows), 0.0),
+        "rain_probability": rain_probability,
+        "snow_probability": np.zeros(n_rows),
+        "uv_index": np.clip(6 * day, 0, None),
+        "dewpoint": temperature - (100 - humidity) / 5,
+        "visibility": np.clip(10 - cloud / 25 + rng.normal(0, 0.5, n_rows), 0, 10),
+        "cloud": cloud,
+    })
+    return frame[TARGETS].astype(np.float32)
+
+
+def fitted_scaler(df):
+    from sklearn.preprocessing import StandardScaler
+    return StandardScaler().fit(df[TARGETS].to_numpy())
+
+
+# Each setup_* builds its inputs outside the timed region and returns
+# (fn, items, n_bytes), or None when it cannot run here; items/s and MB/s are
+# derived from them.
+
+def setup_create_sequences(rows, transfer_mb, workdir):
+    from windowing import create_sequences
+    X = synthetic_weather_frame(rows).to_numpy()
+
+    def run():
+        X_seq, y_seq = create_sequences(X, X, SEQ_LEN)
+        # The windows are views; touching them is what downstream code pays for.
+        np.ascontiguousarray(X_seq[:, -1]).sum()
+    return run, rows - SEQ_LEN, X.nbytes
+
+
+def setup_prepare_data(rows, transfer_mb, workdir):
+    from weather_test import prepare_data
+    df = synthetic_weather_frame(rows)
+    scaler = fitted_scaler(df)
+
+    def run():
+        prepare_data(df, TARGETS, TARGETS, HORIZON, SEQ_LEN, scaler)
+    return run, rows - HORIZON - SEQ_LEN, df.memory_usage(deep=True).sum()
+
+
+def _setup_train(rows, loop=None):
+    import torch
+    from weather_test import prepare_data
+    from train_incremental_2 import TRAIN_LOOP, epoch_runner, make_optimizer
+    loop = loop or TRAIN_LOOP
+    from tcn import TCN
+    df = synthetic_weather_frame(rows)
+    X_seq, y_seq = prepare_data(df, TARGETS, TARGETS, HORIZON, SEQ_LEN, fitted_scaler(df))
+    X = torch.tensor(X_seq, dtype=torch.float32)
+    y = torch.tensor(y_seq, dtype=torch.float32)
+    torch.manual_seed(0)
+    model = TCN(len(TARGETS), len(TARGETS))
+    optimizer = make_optimizer(model, loop)
+    loss_fn = torch.nn.MSELoss()
+    model.train()
+    run = epoch_runner(model, optimizer, loss_fn, X, y, BATCH_SIZE, loop)
+    return run, len(X), X.numel() * X.element_size()
+
+
+def setup_train_epoch(rows, transfer_mb, workdir):
+    # The configured training loop (TRAIN_LOOP, TRAIN_PRECISION, TRAIN_COMPILE).
+    return _setup_train(rows)
+
+
+def setup_train_epoch_loader(rows, transfer_mb, workdir):
+    # The DataLoader reference loop, to keep the fast path's gain visible.
+    return _setup_train(rows, "loader")
+
+
+def setup_test_one_model(rows, transfer_mb, workdir):
+    import torch
+    from checkpoint import CHECKPOINT_EXT, save_checkpoint
+    from weather_test import test_one_model
+    from tcn import TCN
+    df = synthetic_weather_frame(rows, seed=1)
+    scaler = fitted_scaler(synthetic_weather_frame(rows))
+    torch.manual_seed(0)
+    model_path = os.path.join(workdir, f"bench_model{CHECKPOINT_EXT}")
+    save_checkpoint(model_path, TCN(len(TARGETS), len(TARGETS)).state_dict(), {
+        "features": TARGETS,
+        "targets": TARGETS,
+        "seq_len": SEQ_LEN,
+        "horizon": HORIZON,
+        "scaler_mean": scaler.mean_.tolist(),
+        "scaler_scale": scaler.scale_.tolist(),
+        "config": {"seq_len": SEQ_LEN, "horizon": HORIZON, "epochs": 0, "batch_size": BATCH_SIZE},
+    })
+
+    def run():
+        test_one_model(model_path, df)
+    return run, rows - HORIZON - SEQ_LEN, df.memory_usage(deep=True).sum()
+
+
+def _setup_score_candidates(rows, workdir, fused, n_models=3):
+    import torch
+    from checkpoint import CHECKPOINT_EXT, save_checkpoint
+    from weather_test import fuse_models, load_models, score_members
+    from tcn import TCN
+    df = synthetic_weather_frame(rows, seed=1)
+    scaler = fitted_scaler(synthetic_weather_frame(rows))
+    torch.manual_seed(0)
+    for i in range(n_models):
+        save_checkpoint(os.path.join(workdir, f"bench_model_{i}{CHECKPOINT_EXT}"), TCN(len(TARGETS), len(TARGETS)).state_dict(), {
+            "features": TARGETS,
+            "targets": TARGETS,
+            "seq_len": SEQ_LEN,
+            "horizon": HORIZON,
+            "scaler_mean": scaler.mean_.tolist(),
+            "scaler_scale": scaler.scale_.tolist(),
+            "config": {"seq_len": SEQ_LEN, "horizon": HORIZON, "epochs": 0, "batch_size": BATCH_SIZE},
+        })
+    models = load_models(workdir)
+
+    def run():
+        for loaded in (fuse_models(models) if fused else models):
+            score_members(loaded, df)
+    return run, (rows - HORIZON - SEQ_LEN) * n_models, df.memory_usage(deep=True).sum()
+
+
+def setup_score_candidates(rows, transfer_mb, workdir):
+    # Three candidates sharing inputs, scored in one fused pass (weather_test.fuse_models).
+    return _setup_score_candidates(rows, workdir, fused=True)
+
+
+def setup_score_candidates_separate(rows, transfer_mb, workdir):
+    return _setup_score_candidates(rows, workdir, fused=False)
+
+
+def _local_s3():
+    # moto's in-process server stands in for MinIO; None when moto is missing.
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        return None
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"{host}:{port}"
+
+
+def _transfer_payload(workdir, mb):
+    path = os.path.join(workdir, "payload.bin")
+    with open(path, "wb") as f:
+        f.write(np.random.default_rng(0).bytes(mb * 1024 * 1024))
+    return path
+
+
+def setup_s3_upload(rows, transfer_mb, workdir):
+    import boto3
+    import upload_minio
+    s3 = _local_s3()
+    if s3 is None:
+        return None
+    _, endpoint = s3
+    upload_minio.s3_client = boto3.client(
+        "s3", endpoint_url=f"http://{endpoint}", aws_access_key_id="bench", aws_secret_access_key="bench",
+        region_name="us-east-1",
+    )
+    upload_minio.BUCKET_NAME = BUCKET_NAME
+    upload_minio.s3_client.create_bucket(Bucket=BUCKET_NAME)
+    path = _transfer_payload(workdir, transfer_mb)
+
+    def run():
+        upload_minio.upload_object(path, "bench/payload.bin")
+    return run, 1, os.path.getsize(path)
+
+
+def setup_s3_download(rows, transfer_mb, workdir):
+    import boto3
+    from minio import Minio
+    import setup_minio
+    from artifact_cache import ArtifactCache
+    s3 = _local_s3()
+    if s3 is None:
+        return None
+    _, endpoint = s3
+    boto3.client(
+        "s3", endpoint_url=f"http://{endpoint}", aws_access_key_id="bench", aws_secret_access_key="bench",
+        region_name="us-east-1",
+    ).create_bucket(Bucket=BUCKET_NAME)
+    setup_minio.client = Minio(endpoint, access_key="bench", secret_key="bench", secure=False)
+    setup_minio.BUCKET_NAME = BUCKET_NAME
+    path = _transfer_payload(workdir, transfer_mb)
+    setup_minio.client.fput_object(BUCKET_NAME, "bench/payload.bin", path)
+    local_path = os.path.join(workdir, "downloaded.bin")
+
+    def run():
+        # A fresh cache per run, so every download goes over the wire.
+        cache_dir = tempfile.mkdtemp(dir=workdir)
+        setup_minio.cache = ArtifactCache(cache_dir)
+        setup_minio.download_file("bench/payload.bin", local_path)
+        shutil.rmtree(cache_dir)
+    return run, 1, os.path.getsize(path)
+
+
+def setup_s3_read_many(rows, transfer_mb, workdir):
+    # rows split over 8 CSV objects, read back as one frame with s3io.read_many.
+    import boto3
+    import s3io
+    s3 = _local_s3()
+    if s3 is None:
+        return None
+    _, endpoint = s3
+    os.environ.update(
+        S3_ENDPOINT_URL=f"http://{endpoint}", AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench",
+        AWS_DEFAULT_REGION="us-east-1",
+    )
+    client = s3io.get_s3_client()
+    client.create_bucket(Bucket=BUCKET_NAME)
+    frame = synthetic_weather_frame(rows)
+    n_bytes = 0
+    for i, bounds in enumerate(np.array_split(np.arange(len(frame)), 8)):
+        body = frame.iloc[bounds].to_csv(index=False).encode("utf-8")
+        client.put_object(Bucket=BUCKET_NAME, Key=f"daily/part_{i}.csv", Body=body)
+        n_bytes += len(body)
+
+    def run():
+        s3io.read_many(f"s3://{BUCKET_NAME}/daily/", TARGETS, dtype={c: np.float32 for c in TARGETS})
+    return run, rows, n_bytes
+
+
+BENCHMARKS = {
+    "create_sequences": setup_create_sequences,
+    "prepare_data": setup_prepare_data,
+    "train_epoch": setup_train_epoch,
+    "train_epoch_loader": setup_train_epoch_loader,
+    "test_one_model": setup_test_one_model,
+    "score_candidates": setup_score_candidates,
+    "score_candidates_separate": setup_score_candidates_separate,
+    "s3_upload": setup_s3_upload,
+    "s3_download": setup_s3_download,
+    "s3_read_many": setup_s3_read_many,
+}
+
+
+def run_benchmark(name, rows, repeats, transfer_mb):
+    # Runs in a fresh process, so peak RSS belongs to this benchmark alone.
+    import torch
+    torch.set_num_threads(1)
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        setup = BENCHMARKS[name](rows, transfer_mb, workdir)
+        if setup is None:
+            return None
+        fn, items, n_bytes = setup
+        rss_before = current_rss_mb()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        return {
+            "seconds": best,
+            "mean_seconds": float(np.mean(times)),
+            "items": int(items),
+            "items_per_s": items / best,
+            "mb_per_s": n_bytes / 2**20 / best,
+            "peak_rss_mb": peak_rss_mb(),
+            "rss_growth_mb": max(0.0, peak_rss_mb() - rss_before),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    if os.environ.get("GIT_COMMIT"):
+        return os.environ["GIT_COMMIT"]
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_regressions(history, run):
+    # Compares each result with the median of the last comparable runs (same
+    # row count and transfer size) that include that benchmark.
+    regressions = []
+    comparable = [h for h in history if h["rows"] == run["rows"] and h.get("transfer_mb") == run["transfer_mb"]]
+    for name, result in run["results"].items():
+        previous = [h["results"][name] for h in comparable if name in h["results"]][-BENCH_BASELINE_RUNS:]
+        if not previous:
+            continue
+        base_time = float(np.median([p["seconds"] for p in previous]))
+        base_growth = float(np.median([p["rss_growth_mb"] for p in previous]))
+        if result["seconds"] > base_time * (1 + BENCH_TIME_TOLERANCE):
+            regressions.append(f"{name}: {result['seconds']:.3f}s vs baseline {base_time:.3f}s")
+        if result["rss_growth_mb"] > base_growth * (1 + BENCH_MEMORY_TOLERANCE) + BENCH_MEMORY_SLACK_MB:
+            regressions.append(f"{name}: +{result['rss_growth_mb']:.0f} MB RSS vs baseline +{base_growth:.0f} MB")
+    return regressions
+
+
+def run_suite(names, rows=BENCH_ROWS, repeats=BENCH_REPEATS, transfer_mb=BENCH_TRANSFER_MB):
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(run_benchmark, name, rows, repeats, transfer_mb).result()
+        if result is None:
+            print(f"[bench] {name}: skipped (moto is not installed for the local S3 endpoint)")
+            continue
+        results[name] = result
+        print(
+            f"[bench] {name}: {result['seconds']:.3f}s, {result['items_per_s']:.0f} items/s, "
+            f"{result['mb_per_s']:.1f} MB/s, peak RSS {result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB)"
+        )
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "rows": rows,
+        "repeats": repeats,
+        "transfer_mb": transfer_mb,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=BENCH_ROWS, help="Rows in the synthetic weather frame")
+    parser.add_argument("--repeats", type=int, default=BENCH_REPEATS, help="Timed runs per benchmark (best is kept)")
+    parser.add_argument("--transfer-mb", type=int, default=BENCH_TRANSFER_MB, help="Object size for the S3 benchmarks")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks")
+    parser.add_argument("--history", default=BENCH_HISTORY, help="JSON history file to append to")
+    parser.add_argument("--check", action="store_true",
+                        help=f"Exit with code {REGRESSION_EXIT_CODE} when a benchmark regressed against the history")
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    run = run_suite(args.only or list(BENCHMARKS), args.rows, args.repeats, args.transfer_mb)
+    regressions = find_regressions(history, run)
+
+    os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+    with open(args.history, "w", encoding="utf-8") as f:
+        json.dump(history + [run], f, indent=1)
+    print(f"[bench] Results appended to {args.history}")
+
+    for line in regressions:
+        print(f"[bench] REGRESSION {line}")
+    if regressions and args.check:
+        sys.exit(REGRESSION_EXIT_CODE)
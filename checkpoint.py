@@ -0,0 +1,104 @@
+import os
+import json
+import struct
+import numpy as np
+import torch
+
+# Compact checkpoints use the safetensors layout: an 8-byte little-endian header
+# length, a JSON header (tensor dtype/shape/offsets plus "__metadata__"), then the
+# raw little-endian float32 tensor bytes. Model metadata (config, features,
+# targets, scaler stats) is stored as one JSON string under __metadata__.
+CHECKPOINT_EXT = ".safetensors"
+MODEL_EXTS = (".pth", CHECKPOINT_EXT)
+FORMAT_VERSION = 1
+_ALIGN = 8
+
+METADATA_KEYS = ["features", "targets", "seq_len", "horizon", "scaler_mean", "scaler_scale", "config"]
+
+
+def is_compact_checkpoint(path):
+    # Legacy torch checkpoints start with a zip ("PK") or pickle (0x80) magic.
+    with open(path, "rb") as f:
+        head = f.read(9)
+    if len(head) < 9:
+        return False
+    (header_len,) = struct.unpack("<Q", head[:8])
+    return head[8:9] == b"{" and header_len <= os.path.getsize(path) - 8
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    return header, 8 + header_len
+
+
+def save_checkpoint(path, state_dict, metadata):
+    arrays = {
+        name: np.ascontiguousarray(tensor.detach().cpu().numpy(), dtype="<f4")
+        for name, tensor in state_dict.items()
+    }
+    header = {"__metadata__": {"weather": json.dumps(dict(metadata, format_version=FORMAT_VERSION))}}
+    offset = 0
+    for name, arr in arrays.items():
+        header[name] = {"dtype": "F32", "shape": list(arr.shape), "data_offsets": [offset, offset + arr.nbytes]}
+        offset += arr.nbytes
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    # Pad so the tensor body starts 8-byte aligned and can be memory-mapped as float32.
+    header_bytes += b" " * (-(8 + len(header_bytes)) % _ALIGN)
+
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for arr in arrays.values():
+            f.write(arr.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_metadata(path):
+    # Config, features, targets and scaler stats without loading any weights
+    # (for legacy .pth files this still has to unpickle the whole file).
+    if is_compact_checkpoint(path):
+        header, _ = _read_header(path)
+        return json.loads(header["__metadata__"]["weather"])
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    checkpoint.pop("state_dict", None)
+    return checkpoint
+
+
+def load_state_dict(path):
+    # Tensors are copy-on-write views of a memory map of the file body, so
+    # nothing is read until a weight is touched and the file is never modified.
+    header, body_start = _read_header(path)
+    body = np.memmap(path, dtype=np.uint8, mode="c", offset=body_start)
+    state_dict = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        if info["dtype"] != "F32":
+            raise ValueError(f"Unsupported dtype {info['dtype']} for {name} in {path}")
+        start, end = info["data_offsets"]
+        arr = body[start:end].view("<f4").reshape(info["shape"])
+        state_dict[name] = torch.from_numpy(arr)
+    return state_dict
+
+
+def load_checkpoint(path, map_location="cpu"):
+    # Returns the same dict layout for compact and legacy checkpoints.
+    if not is_compact_checkpoint(path):
+        return torch.load(path, map_location=map_location, weights_only=False)
+    checkpoint = read_metadata(path)
+    state_dict = load_state_dict(path)
+    if str(map_location) != "cpu":
+        state_dict = {k: v.to(map_location) for k, v in state_dict.items()}
+    checkpoint["state_dict"] = state_dict
+    return checkpoint
+
+
+def save_legacy_checkpoint(path, checkpoint):
+    # Plain torch.save dict, for consumers that still call torch.load on the file.
+    legacy = {k: checkpoint[k] for k in ["state_dict"] + METADATA_KEYS if k in checkpoint}
+    legacy["state_dict"] = {k: v.clone() for k, v in legacy["state_dict"].items()}
+    torch.save(legacy, path)
@@ -0,0 +1,240 @@
+import os
+import copy
+import glob
+import json
+import time
+import argparse
+import warnings
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+import weather_test
+from ingest import iter_chunks, iter_sequences
+from metrics import regression_metrics
+from inference_runtime import ScaledTCN
+
+BEST_MODEL_DIR = "best_model_final"
+PRODUCTION_PATH = os.path.join(BEST_MODEL_DIR, "weather_model_production.pth")
+INT8_PATH = os.path.join(BEST_MODEL_DIR, "weather_model_production_int8.pt")
+ONNX_PATH = os.path.join(BEST_MODEL_DIR, "weather_model_production.onnx")
+SERVING_INFO_PATH = os.path.join(BEST_MODEL_DIR, "serving.json")
+PARITY_DIR = "dataset_test"
+CALIBRATION_DIR = "dataset_daily"
+
+# static: int8 convs and head, calibrated on training windows; dynamic: int8
+# head only; none: skip quantization.
+EXPORT_QUANTIZATION = os.environ.get("EXPORT_QUANTIZATION", "static")
+EXPORT_ONNX = os.environ.get("EXPORT_ONNX", "0") == "1"
+# Largest relative RMSE increase on dataset_test for the int8 model to be served.
+EXPORT_RMSE_TOLERANCE = float(os.environ.get("EXPORT_RMSE_TOLERANCE", "0.01"))
+CALIBRATION_WINDOWS = int(os.environ.get("EXPORT_CALIBRATION_WINDOWS", "2048"))
+LATENCY_BATCHES = [1, 64]
+LATENCY_RUNS = 200
+
+
+def quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    return "x86" if "x86" in engines else "qnnpack"
+
+
+def calibration_windows(loaded, data_paths, limit=CALIBRATION_WINDOWS):
+    # Scaled windows spread evenly over the calibration files.
+    columns = list(dict.fromkeys(loaded["features"] + loaded["targets"]))
+    windows = []
+    for path in data_paths:
+        for X_seq, _, _ in iter_sequences(
+            iter_chunks(path, columns), loaded["features"], loaded["targets"], loaded["horizon"],
+            loaded["seq_len"], loaded["scaler_X"]
+        ):
+            windows.append(np.asarray(X_seq, dtype=np.float32))
+    if not windows:
+        return None
+    windows = np.concatenate(windows)
+    idx = np.linspace(0, len(windows) - 1, min(limit, len(windows))).astype(int)
+    return torch.from_numpy(windows[idx])
+
+
+def quantize_model(model, mode, calib):
+    model = copy.deepcopy(model).eval()
+    if mode == "dynamic":
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    engine = quantized_engine()
+    torch.backends.quantized.engine = engine
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (calib[:1],))
+        with torch.no_grad():
+            for batch in torch.split(calib, 256):
+                prepared(batch)
+        return convert_fx(prepared)
+
+
+def latency_ms(model, window_shape, batch):
+    x = torch.randn((batch,) + window_shape)
+    with torch.inference_mode():
+        for _ in range(20):
+            model(x)
+        times = []
+        for _ in range(LATENCY_RUNS):
+            start = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1000.0)
+
+
+def parity(loaded, qmodel, data_paths):
+    # Float and int8 predictions on the same test windows.
+    y_true, float_preds, int8_preds = [], [], []
+    for path in data_paths:
+        scored = weather_test.predict_windows(loaded, path)
+        if scored is None:
+            continue
+        preds, y, _ = scored
+        q_preds, _, _ = weather_test.predict_windows(dict(loaded, model=qmodel), path)
+        n_targets = len(loaded["targets"])
+        y_true.append(y.reshape(-1, n_targets))
+        float_preds.append(preds.reshape(-1, n_targets))
+        int8_preds.append(q_preds.reshape(-1, n_targets))
+    if not y_true:
+        return None
+    y_true, float_preds, int8_preds = map(np.concatenate, (y_true, float_preds, int8_preds))
+    return {
+        "float_rmse": regression_metrics(y_true, float_preds)["rmse"],
+        "int8_rmse": regression_metrics(y_true, int8_preds)["rmse"],
+        "max_abs_diff": float(np.abs(int8_preds - float_preds).max()),
+    }
+
+
+def runtime_metadata(loaded):
+    return {
+        "features": loaded["features"],
+        "targets": loaded["targets"],
+        "seq_len": loaded["seq_len"],
+        "horizon": loaded["horizon"],
+    }
+
+
+def save_torchscript(model, loaded, path):
+    # Raw windows in, predictions out: the scaler runs inside the saved graph.
+    scaled = ScaledTCN(model, loaded["scaler_X"].mean_, loaded["scaler_X"].scale_).eval()
+    example = torch.zeros(1, loaded["seq_len"], len(loaded["features"]))
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        traced = torch.jit.trace(scaled, example)
+        torch.jit.save(traced, path, _extra_files={"metadata.json": json.dumps(runtime_metadata(loaded))})
+
+
+def export_onnx(loaded, path):
+    scaled = ScaledTCN(loaded["model"], loaded["scaler_X"].mean_, loaded["scaler_X"].scale_).eval()
+    example = torch.zeros(1, loaded["seq_len"], len(loaded["features"]))
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            torch.onnx.export(
+                scaled, (example,), path, input_names=["window"], output_names=["forecast"],
+                dynamic_axes={"window": {0: "batch"}, "forecast": {0: "batch"}}, dynamo=False,
+            )
+    except ImportError as e:
+        print(f"[export] ONNX export skipped: {e}")
+        return None
+    return path
+
+
+def _write_report(report, out_dir, int8_path):
+    if not report["accepted"] and os.path.exists(int8_path):
+        # Only ship the int8 file when it is the one being served.
+        os.remove(int8_path)
+    with open(os.path.join(out_dir, os.path.basename(SERVING_INFO_PATH)), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"[export] Serving artifact: {report['artifact']}")
+    return report
+
+
+def write_float_report(production_path=PRODUCTION_PATH, error=None):
+    # serving.json naming the float checkpoint, written without loading it:
+    # the fallback when the export itself fails.
+    out_dir = os.path.dirname(production_path)
+    report = {"artifact": os.path.basename(production_path), "quantization": "none", "accepted": False}
+    if error is not None:
+        report["export_error"] = f"{type(error).__name__}: {error}"
+    return _write_report(report, out_dir, os.path.join(out_dir, os.path.basename(INT8_PATH)))
+
+
+def export_production_model(production_path=PRODUCTION_PATH, mode=EXPORT_QUANTIZATION, onnx=EXPORT_ONNX,
+                            tolerance=EXPORT_RMSE_TOLERANCE):
+    # Writes the int8 (and optional ONNX) variants of the production model next
+    # to it, plus serving.json naming the artifact to serve: the int8 model
+    # when its test RMSE is within tolerance of the float model, else the
+    # float checkpoint. Returns the report written to serving.json.
+    loaded = weather_test.load_model(production_path)
+    out_dir = os.path.dirname(production_path)
+    int8_path = os.path.join(out_dir, os.path.basename(INT8_PATH))
+    report = {"artifact": os.path.basename(production_path), "quantization": "none", "accepted": False}
+
+    if onnx:
+        onnx_path = export_onnx(loaded, os.path.join(out_dir, os.path.basename(ONNX_PATH)))
+        if onnx_path:
+            report["onnx"] = os.path.basename(onnx_path)
+            print(f"[export] ONNX model written to {onnx_path}")
+    if mode == "none":
+        return _write_report(report, out_dir, int8_path)
+
+    test_paths = sorted(glob.glob(os.path.join(PARITY_DIR, "*.csv")))
+    if not test_paths:
+        print(f"[export] No parity data in {PARITY_DIR}, keeping the float model")
+        return _write_report(report, out_dir, int8_path)
+
+    calib = None
+    if mode == "static":
+        # Calibrate on training data so the parity check stays out-of-sample.
+        calib_paths = sorted(glob.glob(os.path.join(CALIBRATION_DIR, "*.csv")))[-1:] or test_paths
+        calib = calibration_windows(loaded, calib_paths)
+        if calib is None:
+            print("[export] No calibration windows, keeping the float model")
+            return _write_report(report, out_dir, int8_path)
+    qmodel = quantize_model(loaded["model"], mode, calib)
+    save_torchscript(qmodel, loaded, int8_path)
+
+    scores = parity(loaded, qmodel, test_paths)
+    if scores is None:
+        print("[export] No test windows for parity, keeping the float model")
+        return _write_report(report, out_dir, int8_path)
+
+    window_shape = (loaded["seq_len"], len(loaded["features"]))
+    report.update(scores, quantization=mode)
+    report["rmse_delta"] = scores["int8_rmse"] - scores["float_rmse"]
+    report["rmse_delta_rel"] = report["rmse_delta"] / scores["float_rmse"] if scores["float_rmse"] else 0.0
+    report["float_bytes"] = os.path.getsize(production_path)
+    report["int8_bytes"] = os.path.getsize(int8_path)
+    for batch in LATENCY_BATCHES:
+        report[f"float_latency_ms_b{batch}"] = latency_ms(loaded["model"], window_shape, batch)
+        report[f"int8_latency_ms_b{batch}"] = latency_ms(qmodel, window_shape, batch)
+    report["accepted"] = report["rmse_delta_rel"] <= tolerance
+    if report["accepted"]:
+        report["artifact"] = os.path.basename(int8_path)
+
+    print(
+        f"[export] {mode} int8: RMSE {scores['float_rmse']:.4f} -> {scores['int8_rmse']:.4f} "
+        f"({report['rmse_delta_rel']:+.2%}, tolerance {tolerance:.2%}), "
+        f"size {report['float_bytes'] / 1024:.0f} -> {report['int8_bytes'] / 1024:.0f} KB, "
+        + ", ".join(
+            f"b{b} {report[f'float_latency_ms_b{b}']:.3f} -> {report[f'int8_latency_ms_b{b}']:.3f} ms"
+            for b in LATENCY_BATCHES
+        )
+    )
+    return _write_report(report, out_dir, int8_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=PRODUCTION_PATH, help="Float production checkpoint")
+    parser.add_argument("--quantization", choices=["static", "dynamic", "none"], default=EXPORT_QUANTIZATION)
+    parser.add_argument("--onnx", action="store_true", default=EXPORT_ONNX, help="Also export the float model to ONNX")
+    parser.add_argument("--tolerance", type=float, default=EXPORT_RMSE_TOLERANCE,
+                        help="Largest relative RMSE increase accepted for the int8 model")
+    args = parser.parse_args()
+
+    export_production_model(args.model, args.quantization, args.onnx, args.tolerance)
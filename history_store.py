@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+# Append-only history of the daily data: one float32 .npy shard per day
+# (rows x columns, row-major so a window is one contiguous slice) plus
+# manifest.json with the shard list and running per-column statistics.
+# Shards are opened memory-mapped, so replaying windows from months of data
+# only reads the rows that are sampled.
+HISTORY_DIR = os.environ.get("HISTORY_DIR", "history_store")
+MANIFEST_NAME = "manifest.json"
+
+
+def _combine_stats(stats, data):
+    # Chan et al. parallel form of Welford's update: merges the day's count,
+    # mean and sum of squared deviations into the running ones per column, so
+    # the cost depends on the day's rows only. NaNs are skipped per column.
+    x = data.astype(np.float64)
+    finite = np.isfinite(x)
+    n_b = finite.sum(axis=0).astype(np.float64)
+    mean_b = np.where(finite, x, 0.0).sum(axis=0) / np.maximum(n_b, 1)
+    m2_b = (np.where(finite, x - mean_b, 0.0) ** 2).sum(axis=0)
+
+    n_a, mean_a, m2_a = (np.asarray(stats[k], dtype=np.float64) for k in ("count", "mean", "m2"))
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    safe_n = np.maximum(n, 1)
+    return {
+        "count": n.tolist(),
+        "mean": (mean_a + delta * n_b / safe_n).tolist(),
+        "m2": (m2_a + m2_b + delta ** 2 * n_a * n_b / safe_n).tolist(),
+    }
+
+
+class HistoryStore:
+    def __init__(self, root=HISTORY_DIR, columns=None):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            if columns is not None and list(columns) != self.manifest["columns"]:
+                raise ValueError(f"{root} holds columns {self.manifest['columns']}, not {list(columns)}")
+        elif columns is not None:
+            n = len(columns)
+            self.manifest = {
+                "columns": list(columns),
+                "shards": [],
+                "stats": {"count": [0.0] * n, "mean": [0.0] * n, "m2": [0.0] * n},
+            }
+        else:
+            raise FileNotFoundError(f"No history store at {root}")
+        self._arrays = {}
+        self._valid = {}
+
+    @property
+    def columns(self):
+        return self.manifest["columns"]
+
+    @property
+    def shards(self):
+        return self.manifest["shards"]
+
+    def rows(self):
+        return sum(s["rows"] for s in self.shards)
+
+    def has(self, key):
+        return any(s["key"] == key for s in self.shards)
+
+    def append(self, df, key, name=None):
+        # key identifies the source (file hash or ETag); appending the same day
+        # twice is a no-op. Returns True when a shard was written.
+        if self.has(key):
+            return False
+        data = np.ascontiguousarray(df[self.columns].to_numpy(dtype=np.float32))
+        os.makedirs(self.root, exist_ok=True)
+        file_name = f"shard_{len(self.shards):05d}.npy"
+        path = os.path.join(self.root, file_name)
+        with open(f"{path}.part", "wb") as f:
+            np.save(f, data)
+        os.replace(f"{path}.part", path)
+
+        self.manifest["stats"] = _combine_stats(self.manifest["stats"], data)
+        self.manifest["shards"].append({
+            "file": file_name, "name": name or key, "key": key, "rows": len(data), "appended": time.time(),
+        })
+        tmp_path = f"{self.manifest_path}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+        print(f"[history] Appended {name or key}: {len(data)} rows, {len(self.shards)} shards, {self.rows()} rows total")
+        return True
+
+    def shard(self, i):
+        if i not in self._arrays:
+            self._arrays[i] = np.load(os.path.join(self.root, self.shards[i]["file"]), mmap_mode="r")
+        return self._arrays[i]
+
+    def mean_var(self, columns=None):
+        stats = self.manifest["stats"]
+        count = np.asarray(stats["count"])
+        mean = np.asarray(stats["mean"])
+        var = np.asarray(stats["m2"]) / np.maximum(count, 1)
+        if columns is not None:
+            idx = [self.columns.index(c) for c in columns]
+            count, mean, var = count[idx], mean[idx], var[idx]
+        return count, mean, var
+
+    def scaler(self, columns):
+        # A fitted StandardScaler over everything appended so far.
+        count, mean, var = self.mean_var(columns)
+        scaler = StandardScaler()
+        scaler.mean_ = mean
+        scaler.var_ = var
+        scaler.scale_ = np.where(var > 0, np.sqrt(var), 1.0)
+        scaler.n_samples_seen_ = count.astype(np.int64)
+        scaler.n_features_in_ = len(columns)
+        return scaler
+
+    def _valid_rows(self, i, features, targets, horizon):
+        # Same rows shifted_targets() keeps for this day: every feature and
+        # target observed now and every target observed `horizon` steps ahead.
+        horizons = tuple(horizon) if isinstance(horizon, (list, tuple)) else (horizon,)
+        key = (i, tuple(features), tuple(targets), horizons)
+        if key not in self._valid:
+            data = self.shard(i)
+            cols = [self.columns.index(c) for c in dict.fromkeys(list(features) + list(targets))]
+            t_idx = [self.columns.index(c) for c in targets]
+            valid = np.isfinite(data[:, cols]).all(axis=1)
+            target_ok = np.isfinite(data[:, t_idx]).all(axis=1)
+            for h in horizons:
+                ahead = np.zeros(len(data), dtype=bool)
+                ahead[:len(data) - h] = target_ok[h:]
+                valid &= ahead
+            self._valid[key] = np.flatnonzero(valid)
+        return self._valid[key]
+
+    def _window_counts(self, features, targets, horizon, seq_len, exclude=()):
+        shard_ids, n_windows = [], []
+        for i, s in enumerate(self.shards):
+            if s["key"] in exclude:
+                continue
+            count = len(self._valid_rows(i, features, targets, horizon)) - seq_len
+            if count > 0:
+                shard_ids.append(i)
+                n_windows.append(count)
+        return shard_ids, n_windows
+
+    def count_windows(self, features, targets, horizon, seq_len, exclude=()):
+        return sum(self._window_counts(features, targets, horizon, seq_len, exclude)[1])
+
+    def replay_batch(self, rng, n, features, targets, horizon, seq_len, scaler_X=None, last_steps=None,
+                     exclude=()):
+        # n windows drawn uniformly from every shard except those whose key is in
+        # exclude, built like create_sequences() on each day: X (n, steps,
+        # features), y (n, targets) or (n, len(horizon), targets). last_steps
+        # keeps only the newest steps of each window (see tcn.input_columns).
+        steps = last_steps or seq_len
+        horizons = list(horizon) if isinstance(horizon, (list, tuple)) else [horizon]
+        f_idx = [self.columns.index(c) for c in features]
+        t_idx = [self.columns.index(c) for c in targets]
+
+        shard_ids, n_windows = self._window_counts(features, targets, horizon, seq_len, exclude)
+        X = np.empty((n, steps, len(features)), dtype=np.float32)
+        y = np.empty((n, len(horizons), len(targets)), dtype=np.float32)
+        if not shard_ids or n <= 0:
+            return X[:0], (y[:0] if isinstance(horizon, (list, tuple)) else y[:0, 0])
+
+        ends = np.cumsum(n_windows)
+        picks = rng.integers(ends[-1], size=n)
+        which = np.searchsorted(ends, picks, side="right")
+        offsets = np.arange(seq_len - steps, seq_len)
+        for j in np.unique(which):
+            rows = np.flatnonzero(which == j)
+            i = shard_ids[j]
+            local = picks[rows] - (ends[j - 1] if j else 0)
+            valid = self._valid_rows(i, features, targets, horizon)
+            data = self.shard(i)
+            window_rows = valid[local[:, None] + offsets]
+            X[rows] = data[window_rows][:, :, f_idx]
+            last = valid[local + seq_len - 1]
+            for k, h in enumerate(horizons):
+                y[rows, k] = data[last + h][:, t_idx]
+        if scaler_X is not None:
+            X = ((X - scaler_X.mean_) / scaler_X.scale_).astype(np.float32)
+        return X, (y if isinstance(horizon, (list, tuple)) else y[:, 0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=HISTORY_DIR, help="History store directory")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.root)
+    count, mean, var = store.mean_var()
+    print(f"[history] {len(store.shards)} shards, {store.rows()} rows")
+    for s in store.shards:
+        print(f"  {s['file']}  {s['name']}  {s['rows']} rows")
+    for c, n, m, v in zip(store.columns, count, mean, var):
+        print(f"  {c:18s} n={int(n):8d} mean={m:10.4f} std={np.sqrt(v):10.4f}")
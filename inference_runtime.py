@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn as nn
+from checkpoint import MODEL_EXTS, load_checkpoint
+from tcn import StackedTCN, build_model
+
+MODEL_PATH = os.environ.get("MODEL_PATH", "model.pth")
+INFER_MAX_BATCH = int(os.environ.get("INFER_MAX_BATCH", "64"))
+INFER_MAX_WAIT_MS = float(os.environ.get("INFER_MAX_WAIT_MS", "5"))
+INFER_THREADS = int(os.environ.get("INFER_THREADS", "1"))
+LATENCY_WINDOW = 10_000
+
+
+class ScaledTCN(nn.Module):
+    # Takes raw (unscaled) windows; the StandardScaler step runs inside the graph.
+    def __init__(self, tcn, mean, scale):
+        super().__init__()
+        self.tcn = tcn
+        self.register_buffer("mean", torch.as_tensor(mean, dtype=torch.float32))
+        self.register_buffer("inv_scale", 1.0 / torch.as_tensor(scale, dtype=torch.float32))
+
+    def forward(self, x):
+        return self.tcn((x - self.mean) * self.inv_scale)
+
+
+def _load_tcn(model_path):
+    # Returns (eager TCN, scaler mean, scaler scale, metadata).
+    checkpoint = load_checkpoint(model_path)
+    features = checkpoint["features"]
+    targets = checkpoint["targets"]
+    if "scaler_X" in checkpoint:
+        mean, scale = checkpoint["scaler_X"].mean_, checkpoint["scaler_X"].scale_
+    else:
+        mean, scale = checkpoint["scaler_mean"], checkpoint["scaler_scale"]
+
+    cfg = checkpoint.get("config", {})
+    metadata = {
+        "features": features,
+        "targets": targets,
+        "seq_len": checkpoint.get("seq_len", cfg.get("seq_len")),
+        "horizon": checkpoint.get("horizon", cfg.get("horizon")),
+    }
+    tcn = build_model(len(features), len(targets), metadata["horizon"], checkpoint["state_dict"])
+    return tcn.eval(), mean, scale, metadata
+
+
+def _load_ensemble(model_paths):
+    # Averaging ensemble of checkpoints that share features, targets, seq_len,
+    # horizon and scaler, run as one StackedTCN forward pass.
+    loaded = [_load_tcn(path) for path in model_paths]
+    _, mean, scale, metadata = loaded[0]
+    for path, (_, m, s, meta) in zip(model_paths, loaded):
+        if meta != metadata or not (np.allclose(m, mean) and np.allclose(s, scale)):
+            raise ValueError(f"{path} does not share the inputs and scaler of {model_paths[0]}")
+    ensemble = StackedTCN([tcn for tcn, _, _, _ in loaded], metadata["seq_len"], average=True).eval()
+    return ensemble, mean, scale, dict(metadata, members=[os.path.basename(p) for p in model_paths])
+
+
+def resolve_model_path(model_path):
+    # A model directory (e.g. best_model_final) resolves to the artifact its
+    # serving.json names, as written by export_model.py. A directory without
+    # one (e.g. top3_models_incremental) is served as an averaging ensemble.
+    if not os.path.isdir(model_path) or not os.path.exists(os.path.join(model_path, "serving.json")):
+        return model_path
+    with open(os.path.join(model_path, "serving.json"), "r", encoding="utf-8") as f:
+        return os.path.join(model_path, json.load(f)["artifact"])
+
+
+def load_runtime_model(model_path=MODEL_PATH):
+    # Returns (compiled module, metadata). The module is TorchScript-frozen when
+    # scripting works and falls back to the eager module otherwise. Exported
+    # TorchScript artifacts (.pt, e.g. the int8 model) are loaded as they are.
+    model_path = resolve_model_path(model_path)
+    if model_path.endswith(".pt"):
+        extra_files = {"metadata.json": ""}
+        compiled = torch.jit.load(model_path, map_location="cpu", _extra_files=extra_files).eval()
+        return compiled, json.loads(extra_files["metadata.json"])
+
+    if os.path.isdir(model_path):
+        paths = sorted(os.path.join(model_path, f) for f in os.listdir(model_path) if f.endswith(MODEL_EXTS))
+        tcn, mean, scale, metadata = _load_ensemble(paths)
+    else:
+        tcn, mean, scale, metadata = _load_tcn(model_path)
+    model = ScaledTCN(tcn, mean, scale).eval()
+
+    try:
+        compiled = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.script(model)))
+    except Exception as e:
+        print(f"[runtime] TorchScript freeze failed ({e}), serving the eager model")
+        compiled = model
+    return compiled, metadata
+
+
+def load_streaming_model(model_path=MODEL_PATH):
+    # Returns (StreamingTCN, metadata) for serving rolling forecasts: feed each
+    # station's newest raw observation to update() instead of resending the
+    # whole seq_len window.
+    tcn, mean, scale, metadata = _load_tcn(model_path)
+    return tcn.streaming(mean, scale), metadata
+
+
+class InferenceRuntime:
+    # Loads the model once and merges concurrent predict() calls into
+    # micro-batches: a batch is run as soon as max_batch requests are queued or
+    # max_wait_ms has passed since the first queued request.
+
+    def __init__(self, model_path=MODEL_PATH, max_batch=INFER_MAX_BATCH,
+                 max_wait_ms=INFER_MAX_WAIT_MS, threads=INFER_THREADS):
+        torch.set_num_threads(threads)
+        self.model, self.metadata = load_runtime_model(model_path)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.window_shape = (self.metadata["seq_len"], len(self.metadata["features"]))
+        self._queue = queue.Queue()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes = collections.deque(maxlen=LATENCY_WINDOW)
+        self._stopped = threading.Event()
+        self._warmup()
+        self._worker = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._worker.start()
+
+    def _warmup(self):
+        # The first calls of a frozen graph run its profiling passes; keep them out of request latency.
+        with torch.inference_mode():
+            for batch in (1, self.max_batch):
+                self.model(torch.zeros((batch,) + self.window_shape))
+
+    def submit(self, window):
+        window = np.asarray(window, dtype=np.float32)
+        if window.shape != self.window_shape:
+            raise ValueError(f"Expected a window of shape {self.window_shape}, got {window.shape}")
+        future = Future()
+        self._queue.put((window, future, time.perf_counter()))
+        return future
+
+    def predict(self, window, timeout=None):
+        return self.submit(window).result(timeout)
+
+    def predict_dict(self, window, timeout=None):
+        # {target: value}, or {horizon: {target: value}} for a multi-horizon model.
+        pred = self.predict(window, timeout)
+        targets, horizon = self.metadata["targets"], self.metadata["horizon"]
+        if isinstance(horizon, (list, tuple)):
+            return {h: dict(zip(targets, row.tolist())) for h, row in zip(horizon, pred)}
+        return dict(zip(targets, pred.tolist()))
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                with torch.inference_mode():
+                    preds = self.model(torch.from_numpy(np.stack([item[0] for item in batch]))).numpy()
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            for (_, future, submitted), pred in zip(batch, preds):
+                self._latencies.append(done - submitted)
+                future.set_result(pred)
+            self._batch_sizes.append(len(batch))
+
+    def latency_stats(self):
+        if not self._latencies:
+            return {}
+        latencies_ms = np.array(self._latencies) * 1000.0
+        return {
+            "requests": len(latencies_ms),
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "mean_batch": float(np.mean(self._batch_sizes)),
+        }
+
+    def close(self):
+        self._stopped.set()
+        self._worker.join()
+
+
+def load_test(runtime, n_requests, concurrency):
+    rng = np.random.default_rng(0)
+    windows = rng.normal(size=(min(n_requests, 256),) + runtime.window_shape).astype(np.float32)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: runtime.predict(windows[i % len(windows)]), range(n_requests)))
+    elapsed = time.perf_counter() - start
+    stats = runtime.latency_stats()
+    print(
+        f"[runtime] {n_requests} requests x {concurrency} concurrent: {n_requests / elapsed:.0f} req/s, "
+        f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, mean batch {stats['mean_batch']:.1f}"
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH,
+                        help="Champion checkpoint (.pth, .safetensors), exported .pt, a directory with serving.json, "
+                             "or a directory of checkpoints to serve as an ensemble")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    runtime = InferenceRuntime(args.model)
+    try:
+        load_test(runtime, args.requests, args.concurrency)
+    finally:
+        runtime.close()
@@ -0,0 +1,121 @@
+import os
+import time
+import resource
+import numpy as np
+import pandas as pd
+from windowing import create_sequences
+
+# Rows per parsed chunk; 0 parses each file in a single pass.
+DEFAULT_CHUNKSIZE = int(os.environ.get("INGEST_CHUNKSIZE", "50000"))
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def iter_weather_csv(path, columns, chunksize=DEFAULT_CHUNKSIZE or None):
+    # Only the requested columns are parsed, straight into float32. s3:// paths
+    # are streamed from the object store instead of being staged to disk.
+    dtype = {c: np.float32 for c in columns}
+    if path.startswith("s3://"):
+        import s3io
+        yield from s3io.iter_csv(path, columns, chunksize, dtype)
+    elif chunksize:
+        yield from pd.read_csv(path, usecols=list(columns), dtype=dtype, chunksize=chunksize)
+    else:
+        yield pd.read_csv(path, usecols=list(columns), dtype=dtype)
+
+
+def read_weather_csv(path, columns, chunksize=DEFAULT_CHUNKSIZE):
+    # Parses in chunks but returns the whole frame; for a single pass over the
+    # windows, feed iter_weather_csv into iter_sequences instead.
+    start = time.perf_counter()
+    chunks = list(iter_weather_csv(path, columns, chunksize or None))
+    df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    df = df[list(columns)]
+    elapsed = time.perf_counter() - start
+    print(
+        f"[ingest] {os.path.basename(path)}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 2**20:.1f} MB, "
+        f"parsed in {elapsed:.2f}s, peak RSS {peak_rss_mb():.0f} MB"
+    )
+    return df
+
+
+def iter_frame_chunks(df, chunksize=DEFAULT_CHUNKSIZE):
+    chunksize = chunksize or max(len(df), 1)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def iter_chunks(data, columns, chunksize=DEFAULT_CHUNKSIZE):
+    # data is a DataFrame or a CSV path (local or s3://); a path is parsed
+    # chunk by chunk and never held in memory as a whole.
+    if isinstance(data, pd.DataFrame):
+        return iter_frame_chunks(data, chunksize)
+    return iter_weather_csv(data, columns, chunksize or None)
+
+
+def _future_targets(df, targets, horizon, valid):
+    # Returns (y, valid) as arrays. horizon may be a list: y is then
+    # (rows, len(horizon), targets) and a row is only valid when every
+    # horizon's target exists.
+    horizons = horizon if isinstance(horizon, (list, tuple)) else [horizon]
+    shifted = [df[targets].shift(-h) for h in horizons]
+    for y in shifted:
+        valid = valid & y.notna().all(axis=1).to_numpy()
+    if not isinstance(horizon, (list, tuple)):
+        return shifted[0].to_numpy(), valid
+    return np.stack([y.to_numpy() for y in shifted], axis=1), valid
+
+
+def shifted_targets(df, features, targets, horizon):
+    # Same rows and values as shifting each target into a "<t>_y" column and
+    # calling dropna(), without copying the frame.
+    valid = df[list(dict.fromkeys(features + targets))].notna().all(axis=1).to_numpy()
+    y, valid = _future_targets(df, targets, horizon, valid)
+    return df.loc[valid, features].to_numpy(), y[valid], df.loc[valid, targets].to_numpy()
+
+
+def iter_sequences(chunks, features, targets, horizon, seq_len, scaler_X):
+    # Yields (X_seq, y_seq, y_current) per chunk. Concatenated, the windows are
+    # identical to windowing the whole frame at once: the last max(horizon) raw
+    # rows wait for their future targets and the last seq_len valid rows are carried
+    # into the next chunk so windows can cross chunk boundaries.
+    lookahead = max(horizon) if isinstance(horizon, (list, tuple)) else horizon
+    pending = None
+    carry_X = carry_y = carry_cur = None
+    for chunk in chunks:
+        frame = chunk if pending is None else pd.concat([pending, chunk])
+        n_ready = max(len(frame) - lookahead, 0)
+        pending = frame.iloc[n_ready:]
+
+        observed = frame[list(dict.fromkeys(features + targets))].notna().all(axis=1).to_numpy()
+        y, valid = _future_targets(frame, targets, horizon, observed)
+        ready = frame.iloc[:n_ready]
+        valid = valid[:n_ready]
+        if not valid.any():
+            continue
+        X = scaler_X.transform(ready.loc[valid, features].to_numpy())
+        Y = y[:n_ready][valid]
+        cur = ready.loc[valid, targets].to_numpy()
+
+        if carry_X is not None:
+            X = np.concatenate([carry_X, X])
+            Y = np.concatenate([carry_y, Y])
+            cur = np.concatenate([carry_cur, cur])
+
+        X_seq, y_seq = create_sequences(X, Y, seq_len)
+        _, y_cur = create_sequences(X, cur, seq_len)
+        if len(X_seq):
+            yield X_seq, y_seq, y_cur
+
+        carry_X, carry_y, carry_cur = X[-seq_len:], Y[-seq_len:], cur[-seq_len:]
@@ -0,0 +1,202 @@
+import os
+import time
+import socket
+import threading
+import contextlib
+import urllib.error
+import urllib.request
+from datetime import datetime
+from ingest import current_rss_mb, peak_rss_mb
+import tracking
+
+# Stage timings, peak RSS and training throughput for one pipeline script.
+# flush() pushes them to a Prometheus Pushgateway (PUSHGATEWAY_URL), falls back
+# to a .prom file in METRICS_DIR (node_exporter textfile format) when no
+# gateway is configured or reachable, and logs the same values to MLflow
+# through tracking.
+PUSHGATEWAY_URL = os.environ.get("PUSHGATEWAY_URL", "")
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics_logs")
+METRICS_PREFIX = "weather_pipeline"
+MLFLOW_EXPERIMENT = "pipeline_instrumentation"
+RSS_SAMPLE_INTERVAL = float(os.environ.get("RSS_SAMPLE_INTERVAL", "0.2"))
+PUSH_TIMEOUT = 10
+
+_lock = threading.Lock()
+_stages = []
+_epochs = []
+
+
+class _RssSampler(threading.Thread):
+    # Polls the resident set size while a stage runs; ru_maxrss alone only
+    # gives the peak of the whole process so far.
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = current_rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return self.peak
+
+
+class timed(contextlib.ContextDecorator):
+    # with timed("download"): ...   or   @timed("evaluate") on a function.
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # A fresh instance per call, so the decorator is safe for recursion and threads.
+        return timed(self.stage)
+
+    def __enter__(self):
+        self._sampler = _RssSampler()
+        self._sampler.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        peak = self._sampler.stop()
+        record_stage(self.stage, seconds, peak, failed=exc_type is not None)
+        print(f"[metrics] {self.stage}: {seconds:.2f}s, peak RSS {peak:.0f} MB")
+        return False
+
+
+def record_stage(stage, seconds, peak_rss, failed=False):
+    with _lock:
+        _stages.append({"stage": stage, "seconds": seconds, "peak_rss_mb": peak_rss, "failed": failed})
+
+
+def record_epoch(case, epoch, samples, seconds):
+    with _lock:
+        _epochs.append({"case": case, "epoch": epoch, "samples": samples, "seconds": seconds})
+
+
+def drain():
+    # Hands the collected samples to another process (e.g. from a pool worker
+    # back to the parent, which merge()s them).
+    with _lock:
+        collected = {"stages": list(_stages), "epochs": list(_epochs)}
+        _stages.clear()
+        _epochs.clear()
+    return collected
+
+
+def merge(collected):
+    with _lock:
+        _stages.extend(collected["stages"])
+        _epochs.extend(collected["epochs"])
+
+
+def summary():
+    # Per stage: total seconds and the highest peak RSS; per training case:
+    # mean samples/s over its epochs.
+    with _lock:
+        stages, epochs = list(_stages), list(_epochs)
+    by_stage = {}
+    for s in stages:
+        entry = by_stage.setdefault(s["stage"], {"seconds": 0.0, "peak_rss_mb": 0.0, "failed": 0})
+        entry["seconds"] += s["seconds"]
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], s["peak_rss_mb"])
+        entry["failed"] += int(s["failed"])
+    by_case = {}
+    for e in epochs:
+        entry = by_case.setdefault(e["case"], {"samples": 0, "seconds": 0.0, "epochs": 0})
+        entry["samples"] += e["samples"]
+        entry["seconds"] += e["seconds"]
+        entry["epochs"] += 1
+    for entry in by_case.values():
+        entry["samples_per_s"] = entry["samples"] / entry["seconds"] if entry["seconds"] else 0.0
+    return by_stage, by_case, epochs
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(job):
+    by_stage, by_case, _ = summary()
+    p = METRICS_PREFIX
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {p}_{name} {help_text}")
+        lines.append(f"# TYPE {p}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f"{p}_{name}{{{label_text}}} {value}")
+
+    gauge("stage_seconds", "Wall time spent in a pipeline stage.",
+          [({"job": job, "stage": s}, v["seconds"]) for s, v in by_stage.items()])
+    gauge("stage_peak_rss_mb", "Peak resident memory while a stage ran.",
+          [({"job": job, "stage": s}, v["peak_rss_mb"]) for s, v in by_stage.items()])
+    gauge("stage_failed", "1 when the stage raised.",
+          [({"job": job, "stage": s}, int(v["failed"] > 0)) for s, v in by_stage.items()])
+    gauge("train_samples_per_second", "Mean training throughput over a case's epochs.",
+          [({"job": job, "case": c}, v["samples_per_s"]) for c, v in by_case.items()])
+    gauge("train_epochs", "Epochs trained per case.",
+          [({"job": job, "case": c}, v["epochs"]) for c, v in by_case.items()])
+    gauge("process_peak_rss_mb", "Peak resident memory of the whole script.", [({"job": job}, peak_rss_mb())])
+    gauge("last_run_timestamp_seconds", "When the script last pushed metrics.", [({"job": job}, time.time())])
+    return "\n".join(lines) + "\n"
+
+
+def push(job, url=PUSHGATEWAY_URL, metrics_dir=METRICS_DIR):
+    # Returns where the metrics went: the gateway URL or the fallback file.
+    body = prometheus_text(job).encode("utf-8")
+    if url:
+        target = f"{url.rstrip('/')}/metrics/job/{job}/instance/{socket.gethostname()}"
+        request = urllib.request.Request(
+            target, data=body, method="PUT", headers={"Content-Type": "text/plain; version=0.0.4"}
+        )
+        try:
+            urllib.request.urlopen(request, timeout=PUSH_TIMEOUT).close()
+            print(f"[metrics] Pushed {job} metrics to {url}")
+            return target
+        except (urllib.error.URLError, OSError) as e:
+            print(f"[metrics] Pushgateway {url} unreachable ({e}), writing to {metrics_dir}")
+
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f"{job}.prom")
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    print(f"[metrics] Wrote {job} metrics to {path}")
+    return path
+
+
+def log_mlflow(job):
+    # One run per script in its own experiment; per-epoch throughput is logged
+    # with the epoch as the step.
+    by_stage, by_case, epochs = summary()
+    if not by_stage and not epochs:
+        return
+    metrics = {}
+    for stage, v in by_stage.items():
+        metrics[f"{stage}/seconds"] = v["seconds"]
+        metrics[f"{stage}/peak_rss_mb"] = v["peak_rss_mb"]
+    for case, v in by_case.items():
+        metrics[f"{case}/samples_per_s"] = v["samples_per_s"]
+    metrics["process_peak_rss_mb"] = peak_rss_mb()
+
+    with tracking.start_run(MLFLOW_EXPERIMENT, f"{job}_{datetime.now().strftime('%Y%m%d_%H%M%S')}") as run:
+        run.log_metrics(metrics)
+        for e in epochs:
+            if e["seconds"]:
+                run.log_metric(f"{e['case']}/epoch_samples_per_s", e["samples"] / e["seconds"], step=e["epoch"])
+
+
+def flush(job):
+    # Also resets what was collected, so scripts run one after another in the
+    # same process (pipeline.py) each report only their own stages.
+    log_mlflow(job)
+    target = push(job)
+    drain()
+    return target
@@ -0,0 +1,54 @@
+import numpy as np
+
+PER_TARGET_METRICS = ["mae", "rmse", "bias", "nrmse", "skill"]
+AGGREGATE_METRICS = ["mae", "rmse", "nmae", "nrmse", "skill"]
+
+
+def _safe_ratio(num, den):
+    den = np.asarray(den, dtype=np.float64)
+    out = np.full(np.broadcast(num, den).shape, np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def regression_metrics(y_true, y_pred, y_persistence=None):
+    # y_* are (samples x targets). Per-target scores are normalized by the
+    # target's std so hPa, mm and 0-1 probabilities weigh the same in nmae/nrmse.
+    y_true = np.asarray(y_true, dtype=np.float64)
+    err = np.asarray(y_pred, dtype=np.float64) - y_true
+
+    mae = np.abs(err).mean(axis=0)
+    mse = np.square(err).mean(axis=0)
+    rmse = np.sqrt(mse)
+    bias = err.mean(axis=0)
+    scale = y_true.std(axis=0)
+
+    nmae = _safe_ratio(mae, scale)
+    nrmse = _safe_ratio(rmse, scale)
+    if y_persistence is not None:
+        rmse_persistence = np.sqrt(np.square(np.asarray(y_persistence, dtype=np.float64) - y_true).mean(axis=0))
+        skill = 1.0 - _safe_ratio(rmse, rmse_persistence)
+    else:
+        skill = np.full_like(rmse, np.nan)
+
+    return {
+        "n_samples": len(y_true),
+        # Same definitions as sklearn's uniform-average MAE and sqrt(MSE).
+        "mae": float(mae.mean()),
+        "rmse": float(np.sqrt(mse.mean())),
+        "nmae": float(np.nanmean(nmae)) if np.isfinite(nmae).any() else np.nan,
+        "nrmse": float(np.nanmean(nrmse)) if np.isfinite(nrmse).any() else np.nan,
+        "skill": float(np.nanmean(skill)) if np.isfinite(skill).any() else np.nan,
+        "per_target": {"mae": mae, "rmse": rmse, "bias": bias, "nrmse": nrmse, "skill": skill},
+    }
+
+
+def metrics_row(metrics, targets):
+    row = {"n_samples": metrics["n_samples"]}
+    for name in AGGREGATE_METRICS:
+        row[name] = metrics[name]
+    for name in PER_TARGET_METRICS:
+        values = metrics["per_target"][name]
+        for i, t in enumerate(targets):
+            row[f"{t}_{name}"] = float(values[i])
+    return row
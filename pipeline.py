@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import glob
+import time
+import runpy
+import hashlib
+import argparse
+import traceback
+
+# Runs the pipeline scripts in one process, in dependency order, and skips a
+# stage when the fingerprint of its inputs (files, code and env knobs) matches
+# the last successful run and its outputs are still as that run left them.
+# Only the standard library is imported here: torch, pandas and mlflow are
+# imported by the first stage that actually runs, once for all later stages,
+# so a run where every stage is skipped finishes in well under a second.
+PIPELINE_STATE = os.environ.get("PIPELINE_STATE", "pipeline_state.json")
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# inputs None: always run (setup_minio.py reads the bucket, which has no local
+# fingerprint; its downloads are ETag-cached). env: variable prefixes that
+# change what the stage produces. remote: variables that may point the stage
+# at an s3:// prefix instead of its local directory; the object listing (key
+# and ETag) is then part of the fingerprint.
+STAGES = {
+    "setup": {
+        "script": "setup_minio.py",
+        "deps": [],
+        "inputs": None,
+        "outputs": ["dataset_daily", "current_model", "dataset_test", "history_store"],
+        "env": [],
+    },
+    "train": {
+        "script": "train_incremental_2.py",
+        "deps": ["setup"],
+        "inputs": ["dataset_daily", "current_model/model.pth"],
+        "outputs": ["models_incremental", "top3_models_incremental", "training_logs", "history_store"],
+        "env": ["TRAIN_", "GRID_", "HISTORY_DIR"],
+        "remote": ["TRAIN_DATA_URI"],
+    },
+    "evaluate": {
+        "script": "run_evaluation.py",
+        "deps": ["train"],
+        "inputs": ["top3_models_incremental", "dataset_test", "dataset_daily"],
+        "outputs": ["test_logs", "evaluation_logs", "best_model_final"],
+        "env": ["EVAL_", "EXPORT_"],
+        "remote": ["EVAL_DATA_URI"],
+    },
+    "upload": {
+        "script": "upload_minio.py",
+        "deps": ["evaluate"],
+        "inputs": [
+            "top3_models_incremental", "models_incremental", "best_model_final", "evaluation_logs",
+            "dataset_test", "test_logs", "history_store",
+        ],
+        "outputs": [],
+        "env": ["UPLOAD_"],
+    },
+}
+
+
+def stage_order(stages=STAGES):
+    order = []
+
+    def visit(name, path=()):
+        if name in path:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + (name,))}")
+        if name in order:
+            return
+        for dep in stages[name]["deps"]:
+            visit(dep, path + (name,))
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+def load_state(path=PIPELINE_STATE):
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state, path=PIPELINE_STATE):
+    state["files"] = {p: v for p, v in state["files"].items() if os.path.exists(p)}
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def list_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names)
+        elif os.path.exists(path):
+            files.append(path)
+    return sorted(f.replace("\\", "/") for f in files)
+
+
+def file_digest(path, file_cache):
+    # SHA-256 of the content, reused while size and mtime are unchanged.
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    cached = file_cache.get(path)
+    if cached and cached["stamp"] == stamp:
+        return cached["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    file_cache[path] = {"stamp": stamp, "sha256": h.hexdigest()}
+    return file_cache[path]["sha256"]
+
+
+def tree_digest(paths, file_cache):
+    h = hashlib.sha256()
+    for path in list_files(paths):
+        h.update(f"{path}\0{file_digest(path, file_cache)}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def remote_digest(stage):
+    # Key and ETag of every object under the stage's s3:// data prefixes.
+    # s3io (boto3, pandas) is only imported when such a prefix is configured.
+    h = hashlib.sha256()
+    for var in stage.get("remote", []):
+        uri = os.environ.get(var, "")
+        if uri.startswith("s3://"):
+            import s3io
+            for path, etag, _ in s3io.list_objects(uri):
+                h.update(f"{path}\0{etag}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def input_digest(stage, file_cache):
+    # Every module of the project counts as code: any edit reruns every stage.
+    # None when the remote listing fails: the stage then always runs.
+    try:
+        remote = remote_digest(stage)
+    except Exception as e:
+        print(f"[pipeline] Cannot list the remote inputs ({e}); not memoizing")
+        return None
+    h = hashlib.sha256(remote.encode("utf-8"))
+    h.update(tree_digest(stage["inputs"], file_cache).encode("utf-8"))
+    h.update(tree_digest(sorted(glob.glob(os.path.join(PROJECT_DIR, "*.py"))), file_cache).encode("utf-8"))
+    for key in sorted(os.environ):
+        if any(key.startswith(prefix) for prefix in stage["env"]):
+            h.update(f"{key}={os.environ[key]}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def run_script(script, args=()):
+    # Runs a script as __main__ in this process; returns its exit code.
+    path = os.path.join(PROJECT_DIR, script)
+    saved_argv = sys.argv
+    sys.argv = [path] + list(args)
+    try:
+        runpy.run_path(path, run_name="__main__")
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = saved_argv
+
+
+def run_pipeline(names=None, force=(), state_path=PIPELINE_STATE, dry_run=False):
+    # Runs the given stages (all by default) in dependency order. Returns the
+    # exit code of the first failing stage, or 0.
+    state = load_state(state_path)
+    file_cache = state["files"]
+    selected = set(names or STAGES)
+    for name in stage_order():
+        if name not in selected:
+            continue
+        stage = STAGES[name]
+        started = time.perf_counter()
+        inputs = None if stage["inputs"] is None else input_digest(stage, file_cache)
+        last = state["stages"].get(name, {})
+        if (
+            inputs is not None and name not in force and last.get("inputs") == inputs
+            and last.get("outputs") == tree_digest(stage["outputs"], file_cache)
+        ):
+            print(f"[pipeline] {name}: skipped, inputs unchanged since {last['finished']}")
+            continue
+        if dry_run:
+            print(f"[pipeline] {name}: would run {stage['script']}")
+            continue
+
+        print(f"[pipeline] {name}: running {stage['script']}")
+        code = run_script(stage["script"])
+        seconds = time.perf_counter() - started
+        if code:
+            print(f"[pipeline] {name}: failed with exit code {code} after {seconds:.1f}s")
+            state["stages"].pop(name, None)
+            save_state(state, state_path)
+            return code
+        if inputs is not None:
+            state["stages"][name] = {
+                "inputs": inputs,
+                "outputs": tree_digest(stage["outputs"], file_cache),
+                "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "seconds": round(seconds, 3),
+            }
+        save_state(state, state_path)
+        print(f"[pipeline] {name}: done in {seconds:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stages", nargs="*", help=f"Stages to consider, run in dependency order (default: all of {', '.join(STAGES)})")
+    parser.add_argument("--force", nargs="*", choices=list(STAGES), default=[],
+                        help="Run these stages even when their inputs are unchanged")
+    parser.add_argument("--state", default=PIPELINE_STATE, help="Fingerprint file of the last successful runs")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages would run")
+    args = parser.parse_args()
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages {unknown}; choose from {list(STAGES)}")
+
+    sys.exit(run_pipeline(args.stages or None, set(args.force), args.state, args.dry_run))
@@ -0,0 +1,44 @@
+import os
+import argparse
+from transfer import TRANSFER_WORKERS, TransferStats, run_transfers
+from upload_minio import s3_client, BUCKET_NAME, file_sha256, load_manifest, manifest_key
+
+
+def restore_file(key, local_path, sha256):
+    os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+    tmp_path = f"{local_path}.part"
+    s3_client.download_file(BUCKET_NAME, key, tmp_path)
+    if file_sha256(tmp_path) != sha256:
+        os.remove(tmp_path)
+        raise ValueError(f"checksum mismatch for {key}")
+    os.replace(tmp_path, local_path)
+    return os.path.getsize(local_path)
+
+
+def restore_run(run, dest, workers=TRANSFER_WORKERS):
+    manifest = load_manifest(manifest_key(run))
+    if manifest is None:
+        print(f"No manifest found for run {run}")
+        return False
+
+    print(f"--- Restoring run {manifest['run']} into {dest} ---")
+    tasks = [
+        (local_path, (entry["key"], os.path.join(dest, local_path), entry["sha256"]))
+        for local_path, entry in manifest["files"].items()
+    ]
+    stats = TransferStats(f"restore {manifest['run']}")
+    failed = run_transfers(tasks, restore_file, stats, workers)
+    stats.report()
+    for local_path in failed:
+        print(f"Error restoring {local_path}")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", default="latest", help="Run timestamp (e.g. 20250101_120000) or 'latest'")
+    parser.add_argument("--dest", default=".", help="Directory to rebuild the run's tree in")
+    args = parser.parse_args()
+
+    if not restore_run(args.run, args.dest):
+        raise SystemExit(1)
@@ -1,49 +1,149 @@
 import os
-import subprocess
+import argparse
+import multiprocessing
 import pandas as pd
 import shutil
-import mlflow
+import torch
+from concurrent.futures import ProcessPoolExecutor
+
+import weather_test
+import instrumentation
+import tracking
+import s3io
+from select_best_model_2 import select_the_champion, CHAMPION_METRIC
 
 # Cấu hình
 DATASET_DIR = "dataset_test"
-LOG_DIR = "test_logs"
+LOG_DIR = weather_test.LOG_DIR
 EVAL_LOG_DIR = "evaluation_logs"
 SUMMARY_PATH = os.path.join(EVAL_LOG_DIR, "evaluation_summary.csv")
 
-mlflow.set_tracking_uri("https://mlflow.neikoscloud.net")
-mlflow.set_experiment("weather_evaluation")
+# Models loaded once per evaluation worker by the pool initializer.
+_WORKER_MODELS = []
+
+
+def _init_eval_worker(model_dir, torch_threads):
+    torch.set_num_threads(torch_threads)
+    _WORKER_MODELS[:] = weather_test.load_models(model_dir)
+
+
+def _evaluate_case(case):
+    data_path, case_name, fmt = case
+    with instrumentation.timed("evaluate_dataset"):
+        paths = weather_test.evaluate_dataset(_WORKER_MODELS, data_path, case_name, LOG_DIR, fmt)
+    return paths, instrumentation.drain()
+
+
+def evaluate_datasets(test_datasets, model_dir=weather_test.MODEL_DIR, workers=1, torch_threads=1, fmt="csv"):
+    # Returns (result_path, metrics_path) for each dataset, as case_1..case_N.
+    cases = [(data_path, f"case_{idx}", fmt) for idx, data_path in enumerate(test_datasets, 1)]
+    if workers <= 1 or len(cases) <= 1:
+        with instrumentation.timed("load_models"):
+            models = weather_test.load_models(model_dir)
+        results = []
+        for data_path, case_name, fmt in cases:
+            with instrumentation.timed("evaluate_dataset"):
+                results.append(weather_test.evaluate_dataset(models, data_path, case_name, LOG_DIR, fmt))
+        return results
+
+    print(f"Evaluating {len(cases)} datasets on {workers} workers x {torch_threads} torch threads")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_eval_worker,
+        initargs=(model_dir, torch_threads),
+    ) as pool:
+        results = []
+        for paths, collected in pool.map(_evaluate_case, cases):
+            instrumentation.merge(collected)
+            results.append(paths)
+        return results
+
+
+def summarize_metrics(metric_frames):
+    # Sample-weighted mean over test cases, which matches averaging the old
+    # per-sample detail rows for mae/rmse. One row per (model, horizon): a
+    # multi-horizon model is scored at each horizon it predicts, and rows are
+    # only comparable within a horizon.
+    df = pd.concat(metric_frames, ignore_index=True)
+    value_cols = [c for c in df.columns if c not in ("model", "horizon", "n_samples")]
+    keys = [df["model"], df["horizon"]]
+    weights = df["n_samples"].astype(float)
+    weighted = df[value_cols].mul(weights, axis=0)
+    # NaN scores (e.g. zero-variance targets) drop out of both numerator and denominator.
+    weight_sums = df[value_cols].notna().mul(weights, axis=0).groupby(keys).sum()
+    summary = weighted.groupby(keys).sum(min_count=1) / weight_sums
+    summary.insert(0, "n_samples", df["n_samples"].groupby(keys).sum())
+    return summary.reset_index().sort_values(["horizon", CHAMPION_METRIC])
 
 
-with mlflow.start_run(run_name=f"Eval_Batch_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}"):
+def log_summary_metrics(run, summary):
+    run.log_metric("global_avg_rmse", summary["rmse"].mean())
+    run.log_metric(f"global_avg_{CHAMPION_METRIC}", summary[CHAMPION_METRIC].mean())
+    per_model = {}
+    for _, row in summary.iterrows():
+        for col in summary.columns:
+            if col in ("model", "horizon", "n_samples") or pd.isna(row[col]):
+                continue
+            per_model[f"{row['model']}/h{row['horizon']}/{col}"] = float(row[col])
+    run.log_metrics(per_model)
 
-    if os.path.exists(LOG_DIR):
-        shutil.rmtree(LOG_DIR)
-    os.makedirs(LOG_DIR, exist_ok=True)
-    os.makedirs(EVAL_LOG_DIR, exist_ok=True)
 
-    
-    TEST_DATASETS = sorted([os.path.join(DATASET_DIR, f) for f in os.listdir(DATASET_DIR) if f.endswith(".csv")])
-    
-    for idx, data_path in enumerate(TEST_DATASETS, 1):
-        case_name = f"case_{idx}"
-        
-        subprocess.run(["python3", "weather_test.py", "--data", data_path, "--out_name", case_name])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("EVAL_WORKERS", "1")),
+                        help="Number of evaluation worker processes")
+    parser.add_argument("--torch-threads", type=int, default=int(os.environ.get("EVAL_TORCH_THREADS", "1")),
+                        help="Torch intra-op threads per worker")
+    parser.add_argument("--format", choices=weather_test.RESULT_FORMATS, default=os.environ.get("EVAL_RESULT_FORMAT", "csv"),
+                        help="Per-case result file format")
+    parser.add_argument("--data", default=os.environ.get("EVAL_DATA_URI", DATASET_DIR),
+                        help="Directory or s3://bucket/prefix holding the test CSVs")
+    args = parser.parse_args()
 
-    
-    all_results = []
-    for idx in range(1, len(TEST_DATASETS) + 1):
-        csv_path = os.path.join(LOG_DIR, f"case_{idx}_result.csv")
-        if os.path.exists(csv_path):
-            all_results.append(pd.read_csv(csv_path))
+    tracking.replay()
 
-    if all_results:
-        df_detail = pd.concat(all_results, ignore_index=True)
-        summary = df_detail.groupby("model")[["mae", "rmse"]].mean().reset_index().sort_values("rmse")
-        summary.to_csv(SUMMARY_PATH, index=False)
-        
-        mlflow.log_metric("global_avg_rmse", summary["rmse"].mean())
+    has_results = False
+    with tracking.start_run("weather_evaluation", f"Eval_Batch_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}") as run:
 
+        if os.path.exists(LOG_DIR):
+            shutil.rmtree(LOG_DIR)
+        os.makedirs(LOG_DIR, exist_ok=True)
+        os.makedirs(EVAL_LOG_DIR, exist_ok=True)
+
+
+        if s3io.is_s3_path(args.data):
+            # Workers stream each object from the store; nothing is staged to disk.
+            TEST_DATASETS = [path for path, _, _ in s3io.list_objects(args.data)]
+        else:
+            TEST_DATASETS = sorted([os.path.join(args.data, f) for f in os.listdir(args.data) if f.endswith(".csv")])
+
+        with instrumentation.timed("evaluate_total"):
+            result_paths = evaluate_datasets(
+                TEST_DATASETS, workers=args.workers, torch_threads=max(1, args.torch_threads), fmt=args.format
+            )
+
+
+        # The summary only needs the small per-case metrics files, not the per-sample results.
+        metric_frames = []
+        for _, metrics_path in result_paths:
+            if metrics_path and os.path.exists(metrics_path):
+                metric_frames.append(pd.read_csv(metrics_path))
+
+        if metric_frames:
+            with instrumentation.timed("summarize"):
+                summary = summarize_metrics(metric_frames)
+                summary.to_csv(SUMMARY_PATH, index=False)
+
+            log_summary_metrics(run, summary)
+            has_results = True
+        else:
+            print("There are no results to summarize.")
+
+    # The champion run is a separate MLflow run, so it starts after the batch run has closed.
+    if has_results:
         print("\n Looking for a Champion...")
-        subprocess.run(["python3", "select_best_model_2.py"])
-    else:
-        print("There are no results to summarize.")
\ No newline at end of file
+        with instrumentation.timed("select_champion"):
+            select_the_champion()
+
+    instrumentation.flush("run_evaluation")
@@ -1,34 +1,137 @@
 import os
+import time
+import threading
 import boto3
 import pandas as pd
-from io import StringIO
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+from transfer import TRANSFER_WORKERS, with_retries
+
+# Parallel object reads in read_many(); also the size of the client's connection pool.
+S3IO_WORKERS = int(os.environ.get("S3IO_WORKERS", str(TRANSFER_WORKERS)))
+S3IO_CHUNKSIZE = int(os.environ.get("S3IO_CHUNKSIZE", "50000"))
+
+# One client per endpoint and credentials for the whole process. boto3 clients
+# are thread-safe, so every read (and every read_many thread) reuses the same
+# connection pool instead of opening new connections per call.
+_clients = {}
+_clients_lock = threading.Lock()
+
 
 def get_s3_client():
     endpoint = os.environ.get("S3_ENDPOINT_URL", None)
     access_key = os.environ.get("AWS_ACCESS_KEY_ID")
     secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
-    
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        endpoint_url=endpoint
-    )
-    return s3
 
-def read_csv(s3_path):
-    client = get_s3_client()
-    
-    if not s3_path.startswith("s3://"):
+    key = (endpoint, access_key, secret_key)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(
+                "s3",
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                endpoint_url=endpoint,
+                config=Config(
+                    max_pool_connections=max(S3IO_WORKERS, 10),
+                    retries={"max_attempts": 3, "mode": "standard"},
+                ),
+            )
+        return _clients[key]
+
+
+def is_s3_path(path):
+    return isinstance(path, str) and path.startswith("s3://")
+
+
+def split_s3_path(s3_path):
+    if not is_s3_path(s3_path):
         raise ValueError("Path must start with s3://")
-    
-    path_parts = s3_path.replace("s3://", "").split("/", 1)
-    bucket_name = path_parts[0]
-    key = path_parts[1]
-    
-    print(f"[s3io] Downloading s3://{bucket_name}/{key} ...")
-    if os.environ.get("S3_ENDPOINT_URL"):
-        print(f"[s3io] Using Endpoint: {os.environ.get('S3_ENDPOINT_URL')}")
-
-    obj = client.get_object(Bucket=bucket_name, Key=key)
-    return pd.read_csv(obj['Body'])
\ No newline at end of file
+    bucket_name, _, key = s3_path[len("s3://"):].partition("/")
+    return bucket_name, key
+
+
+def list_objects(s3_prefix, suffix=".csv"):
+    # (s3 path, etag, size) for every object under the prefix, sorted by key.
+    bucket_name, prefix = split_s3_path(s3_prefix)
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    objects = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(suffix):
+                objects.append((f"s3://{bucket_name}/{obj['Key']}", obj["ETag"].strip('"'), obj["Size"]))
+    return sorted(objects)
+
+
+def open_body(s3_path):
+    # Streaming body: the parser pulls it in buffered reads, so the whole
+    # object is never held in memory at once.
+    bucket_name, key = split_s3_path(s3_path)
+    return get_s3_client().get_object(Bucket=bucket_name, Key=key)["Body"]
+
+
+def iter_csv(s3_path, columns=None, chunksize=S3IO_CHUNKSIZE, dtype=None, time_column=None, start=None, end=None):
+    # Yields frames of at most chunksize rows. columns limits parsing to those
+    # columns (in that order); start/end keep rows whose time_column falls in
+    # [start, end].
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(list(columns) + ([time_column] if time_column else [])))
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    body = open_body(s3_path)
+    try:
+        if chunksize:
+            reader = pd.read_csv(body, usecols=usecols, dtype=dtype, chunksize=chunksize)
+        else:
+            reader = [pd.read_csv(body, usecols=usecols, dtype=dtype)]
+        for chunk in reader:
+            if time_column and (start is not None or end is not None):
+                times = pd.to_datetime(chunk[time_column])
+                keep = pd.Series(True, index=chunk.index)
+                if start is not None:
+                    keep &= times >= start
+                if end is not None:
+                    keep &= times <= end
+                chunk = chunk[keep]
+            if columns is not None:
+                chunk = chunk[list(columns)]
+            yield chunk
+    finally:
+        body.close()
+
+
+def read_csv(s3_path, columns=None, chunksize=S3IO_CHUNKSIZE, dtype=None, time_column=None, start=None, end=None,
+             verbose=True):
+    if verbose:
+        print(f"[s3io] Reading {s3_path} ...")
+        if os.environ.get("S3_ENDPOINT_URL"):
+            print(f"[s3io] Using Endpoint: {os.environ.get('S3_ENDPOINT_URL')}")
+    chunks = list(iter_csv(s3_path, columns, chunksize, dtype, time_column, start, end))
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_many(s3_prefix, columns=None, workers=S3IO_WORKERS, suffix=".csv", **kwargs):
+    # Every object under the prefix, fetched concurrently and concatenated in
+    # key order. kwargs go to read_csv (chunksize, dtype, time range).
+    objects = list_objects(s3_prefix, suffix)
+    if not objects:
+        return pd.DataFrame(columns=columns)
+    started = time.perf_counter()
+
+    def read_one(path):
+        return with_retries(lambda: read_csv(path, columns, verbose=False, **kwargs), label=path)[0]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(objects)))) as pool:
+        frames = list(pool.map(read_one, [path for path, _, _ in objects]))
+    df = pd.concat(frames, ignore_index=True)
+    size_mb = sum(size for _, _, size in objects) / 2**20
+    elapsed = time.perf_counter() - started
+    print(
+        f"[s3io] {s3_prefix}: {len(objects)} objects, {size_mb:.1f} MB, {len(df)} rows "
+        f"in {elapsed:.2f}s ({size_mb / max(elapsed, 1e-9):.1f} MB/s)"
+    )
+    return df
@@ -1,18 +1,52 @@
 import pandas as pd
 import shutil
 import os
-import mlflow
+from checkpoint import is_compact_checkpoint, load_checkpoint, read_metadata, save_legacy_checkpoint
+from export_model import export_production_model, write_float_report
+from tcn import build_model
+import instrumentation
+import tracking
 
 SUMMARY_PATH = "evaluation_logs/evaluation_summary.csv"
 MODEL_SOURCE_DIR = "top3_models_incremental"
 BEST_MODEL_DIR = "best_model_final"
+# Mean per-target RMSE / std, so no single unit (e.g. pressure in hPa) dominates the ranking.
+CHAMPION_METRIC = "nrmse"
+# Horizon served from the production slot (default: the shortest evaluated).
+# Models are only ranked against others at the same horizon.
+CHAMPION_HORIZON = os.environ.get("EVAL_CHAMPION_HORIZON")
+
+def single_head_checkpoint(checkpoint, horizon):
+    # The serving image builds a single-horizon TCN, so a multi-horizon
+    # champion keeps only the head block of the served horizon.
+    base_horizon = checkpoint["config"]["horizon"]
+    if not isinstance(base_horizon, (list, tuple)):
+        return checkpoint
+    model = build_model(len(checkpoint["features"]), len(checkpoint["targets"]), horizon,
+                        checkpoint["state_dict"], base_horizon=base_horizon)
+    return dict(checkpoint, state_dict=model.state_dict(), horizon=horizon,
+                config=dict(checkpoint["config"], horizon=horizon))
 
 def select_the_champion():
     if not os.path.exists(SUMMARY_PATH): return
     df = pd.read_csv(SUMMARY_PATH)
     if df.empty: return
 
-    best_model_info = df.iloc[0]
+    # Older summaries only carry mae/rmse, and one row per model: all models
+    # then form a single bracket served at the horizon of the best one.
+    metric = CHAMPION_METRIC if CHAMPION_METRIC in df.columns else "rmse"
+    if "horizon" not in df.columns:
+        best = df.sort_values(metric).head(1)
+        horizon = read_metadata(os.path.join(MODEL_SOURCE_DIR, best["model"].iloc[0]))["horizon"]
+        if isinstance(horizon, (list, tuple)):
+            horizon = int(CHAMPION_HORIZON) if CHAMPION_HORIZON and int(CHAMPION_HORIZON) in horizon else horizon[0]
+        df = best.assign(horizon=horizon)
+    champions = df.sort_values(metric).groupby("horizon").head(1).sort_values("horizon")
+    horizon = int(CHAMPION_HORIZON) if CHAMPION_HORIZON else int(champions["horizon"].iloc[0])
+    if horizon not in set(champions["horizon"]):
+        print(f"No model was evaluated at horizon {horizon}.")
+        return
+    best_model_info = champions[champions["horizon"] == horizon].iloc[0]
     best_model_name = best_model_info['model']
     best_rmse = best_model_info['rmse']
 
@@ -23,17 +57,45 @@ def select_the_champion():
 
     with open(info_path, "w") as f:
         f.write(f"Best Model: {best_model_name}\n")
+        f.write(f"Horizon: {horizon}\n")
         f.write(f"RMSE: {best_rmse:.4f}")
+        if metric != "rmse":
+            f.write(f"\n{metric.upper()}: {best_model_info[metric]:.4f}")
+        for _, row in champions.iterrows():
+            f.write(f"\nBest at h{row['horizon']}: {row['model']} ({metric.upper()} {row[metric]:.4f})")
+
+    # The serving image still torch.load()s the production file, so compact
+    # and multi-horizon checkpoints are converted to a plain single-head .pth.
+    checkpoint = load_checkpoint(source_path)
+    if is_compact_checkpoint(source_path) or isinstance(checkpoint["config"]["horizon"], (list, tuple)):
+        save_legacy_checkpoint(destination_path, single_head_checkpoint(checkpoint, horizon))
+    else:
+        shutil.copy(source_path, destination_path)
 
-    shutil.copy(source_path, destination_path)
+    # int8/ONNX variants plus serving.json; the float file above stays the
+    # base checkpoint for the next incremental training run.
+    # A failed export must not cost the release: serving.json then names the
+    # float checkpoint.
+    with instrumentation.timed("export_model"):
+        try:
+            export_report = export_production_model(destination_path)
+        except Exception as e:
+            print(f"[export] Export failed ({type(e).__name__}: {e}), serving the float model")
+            export_report = write_float_report(destination_path, e)
 
-    mlflow.set_tracking_uri("https://mlflow.neikoscloud.net")
-    mlflow.set_experiment("weather_evaluation")
-    
-    with mlflow.start_run(run_name="Champion_Final"):
-        mlflow.log_param("champion_model", best_model_name)
-        mlflow.log_metric("best_rmse", best_rmse)
+    with tracking.start_run("weather_evaluation", "Champion_Final") as run:
+        run.log_param("champion_model", best_model_name)
+        run.log_param("champion_horizon", horizon)
+        run.log_metric("best_rmse", best_rmse)
+        if metric != "rmse":
+            run.log_metric(f"best_{metric}", best_model_info[metric])
+        run.log_metrics({f"best_{metric}_h{row['horizon']}": float(row[metric]) for _, row in champions.iterrows()})
+        run.log_param("serving_artifact", export_report["artifact"])
+        run.log_metrics({
+            f"export_{k}": float(v) for k, v in export_report.items()
+            if isinstance(v, (int, float)) and not isinstance(v, bool)
+        })
 
-    print(f"Champion selected: {best_model_name} with RMSE: {best_rmse:.4f}")
+    print(f"Champion selected: {best_model_name} (h{horizon}) with RMSE: {best_rmse:.4f}")
 if __name__ == "__main__":
     select_the_champion()
\ No newline at end of file
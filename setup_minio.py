@@ -1,25 +1,47 @@
 import os
 import sys
+import certifi
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
 from minio.error import S3Error
+from artifact_cache import ArtifactCache, materialize
+import instrumentation
+from transfer import (
+    TRANSFER_WORKERS, TransferStats, part_size_for, part_ranges, run_transfers, with_retries
+)
 
 MINIO_URL = "minio.neikoscloud.net"
 ACCESS_KEY = "admin"
 SECRET_KEY = "admin123"
 BUCKET_NAME = "devopsproject"
-
+PART_WORKERS = 4
+
+# One shared connection pool, sized for the transfer threads plus ranged part reads.
+http_client = urllib3.PoolManager(
+    timeout=urllib3.Timeout(connect=300, read=300),
+    maxsize=TRANSFER_WORKERS * PART_WORKERS,
+    cert_reqs="CERT_REQUIRED",
+    ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+)
 
 client = Minio(
     MINIO_URL,
     access_key=ACCESS_KEY,
     secret_key=SECRET_KEY,
-    secure=True # Tương đương https
+    secure=True, # Tương đương https
+    http_client=http_client,
 )
 
-def get_latest_file(prefix):
+cache = ArtifactCache()
+
+def get_latest_object(prefix):
     try:
         objects = client.list_objects(BUCKET_NAME, prefix=prefix, recursive=False)
-        object_list = sorted([obj.object_name for obj in objects])
+        object_list = sorted(
+            [obj for obj in objects if not obj.is_dir], key=lambda obj: obj.object_name
+        )
         
         if not object_list:
             return None
@@ -28,27 +50,85 @@ def get_latest_file(prefix):
         print(f"Error listing objects: {e}")
         return None
 
-def download_file(object_name, local_path):
+def get_latest_file(prefix):
+    obj = get_latest_object(prefix)
+    return obj.object_name if obj else None
+
+def _download_part(object_name, path, offset, length, etag):
+    # If-Match makes every part fail instead of mixing two versions of an object.
+    response = client.get_object(
+        BUCKET_NAME, object_name, offset=offset, length=length, request_headers={"If-Match": etag}
+    )
+    try:
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            for chunk in response.stream(1024 * 1024):
+                f.write(chunk)
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def fetch_object(object_name, path, etag, size):
+    part_size = part_size_for(size)
+    if part_size >= size:
+        client.fget_object(BUCKET_NAME, object_name, path)
+        return
+
+    with open(path, "wb") as f:
+        f.truncate(size)
+    with ThreadPoolExecutor(max_workers=PART_WORKERS) as pool:
+        futures = [
+            pool.submit(_download_part, object_name, path, offset, length, etag)
+            for offset, length in part_ranges(size, part_size)
+        ]
+        for future in futures:
+            future.result()
+
+
+def _download_to_local(object_name, local_path, etag, size):
+    # Returns the number of bytes fetched from MinIO (0 on a cache hit).
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+    if etag is None or size is None:
+        stat = client.stat_object(BUCKET_NAME, object_name)
+        etag, size = stat.etag, stat.size
+
+    blob_path = cache.lookup(etag, size)
+    if blob_path:
+        print(f"Cached {object_name} -> {local_path}")
+        materialize(blob_path, local_path)
+        return 0
+
+    print(f"Downloading {object_name} to {local_path}...")
+    tmp_path = cache.temp_path()
+    try:
+        fetch_object(object_name, tmp_path, etag, size)
+        blob_path = cache.admit(etag, size, tmp_path, object_name)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    materialize(blob_path, local_path)
+    return size
+
+def download_file(object_name, local_path, etag=None, size=None):
 
     try:
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        
-        print(f"Downloading {object_name} to {local_path}...")
-        client.fget_object(BUCKET_NAME, object_name, local_path)
+        with_retries(_download_to_local, object_name, local_path, etag, size, label=object_name)
         return True
     except Exception as e:
         print(f"Error downloading {object_name}: {e}")
         return False
 
 
-def download_directory(minio_prefix, local_dir):
+def download_directory(minio_prefix, local_dir, workers=TRANSFER_WORKERS):
 
     print(f"--- [NEW] DOWNLOADING ENTIRE DIRECTORY: {minio_prefix} ---")
     try:
 
         objects = client.list_objects(BUCKET_NAME, prefix=minio_prefix, recursive=True)
         
-        count = 0
+        tasks = []
         for obj in objects:
 
             if obj.object_name.endswith('/'):
@@ -56,12 +136,14 @@ def download_directory(minio_prefix, local_dir):
                 
             relative_path = obj.object_name
             local_file_path = os.path.join(".", relative_path)
-            
-            if download_file(obj.object_name, local_file_path):
-                count += 1
+            tasks.append((obj.object_name, (obj.object_name, local_file_path, obj.etag, obj.size)))
+
+        stats = TransferStats(f"download {minio_prefix}")
+        failed = run_transfers(tasks, _download_to_local, stats, workers)
+        stats.report()
         
-        print(f"Successfully downloaded {count} files from {minio_prefix}")
-        return True
+        print(f"Successfully downloaded {stats.files} files from {minio_prefix}")
+        return not failed
     except Exception as e:
         print(f"Error downloading directory {minio_prefix}: {e}")
         return False
@@ -69,16 +151,20 @@ def download_directory(minio_prefix, local_dir):
 def main():
     print("--- [1 & 2] SEARCHING FOR LATEST FILES ---")
     
-    data_file_path = get_latest_file("dataset_daily/")
-    model_file_path = get_latest_file("current_model/")
+    data_obj = get_latest_object("dataset_daily/")
+    # current_model/ also holds serving.json and the exported int8 model;
+    # training always starts from the float model.pth.
+    model_obj = get_latest_object("current_model/model")
 
-    if not data_file_path or not model_file_path:
+    if not data_obj or not model_obj:
         print("Error: Cannot find files on MinIO.")
         objects = client.list_objects(BUCKET_NAME, recursive=False)
         for obj in objects:
             print(f"Found: {obj.object_name}")
         sys.exit(1)
 
+    data_file_path = data_obj.object_name
+    model_file_path = model_obj.object_name
     data_filename = os.path.basename(data_file_path)
     model_filename = os.path.basename(model_file_path)
 
@@ -89,16 +175,21 @@ def main():
     local_data = "dataset_daily/dataset.csv"
     local_model = "current_model/model.pth"
 
-    if os.path.exists(local_data) and os.path.exists(local_model):
-        print("--- [RESULT] dataset.csv and model.pth already exist. Skipping download. ---")
-    else:
-        success_data = download_file(data_file_path, local_data)
-        success_model = download_file(model_file_path, local_model)
-        
-        if not success_data or not success_model:
-            print("Download failed!")
-            sys.exit(1)
-    download_directory("dataset_test/", "./dataset_test/")
+    # The cache is keyed by ETag and size, so a new "latest" object is always
+    # fetched and an unchanged one is copied from the local cache.
+    with instrumentation.timed("download_inputs"):
+        success_data = download_file(data_file_path, local_data, data_obj.etag, data_obj.size)
+        success_model = download_file(model_file_path, local_model, model_obj.etag, model_obj.size)
+    
+    if not success_data or not success_model:
+        print("Download failed!")
+        sys.exit(1)
+    with instrumentation.timed("download_test_sets"):
+        download_directory("dataset_test/", "./dataset_test/")
+    # Earlier days for train_incremental_2.py's replay and scaler statistics.
+    with instrumentation.timed("download_history"):
+        download_directory("history_store/", "./history_store/")
+    print(f"Cache: {cache.hits} hits, {cache.misses} misses, {cache.total_bytes() / 1024**2:.1f} MB used")
 
     print("--- [4] VERIFY ---")
     for path in [local_data, local_model]:
@@ -113,7 +204,10 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        with instrumentation.timed("setup_total"):
+            main()
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        instrumentation.flush("setup_minio")
\ No newline at end of file
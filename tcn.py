@@ -0,0 +1,383 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class TCN(nn.Module):
+    def __init__(self, num_inputs, num_outputs):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.Conv1d(num_inputs, 32, 3, padding=2, dilation=1),
+            nn.ReLU(),
+            nn.Conv1d(32, 64, 3, padding=4, dilation=2),
+            nn.ReLU(),
+        )
+        self.fc = nn.Linear(64, num_outputs)
+
+    def forward(self, x):
+        x = x.permute(0, 2, 1)
+        y = self.net(x)
+        return self.fc(y[:, :, -1])
+
+    def streaming(self, mean=None, scale=None):
+        return StreamingTCN(self, mean, scale)
+
+
+class MultiHorizonTCN(TCN):
+    # Same trunk as TCN; the head predicts every horizon in one pass and the
+    # output is (batch, len(horizons), num_outputs).
+    def __init__(self, num_inputs, num_outputs, horizons):
+        super().__init__(num_inputs, num_outputs * len(horizons))
+        self.horizons = list(horizons)
+        self.n_horizons = len(horizons)
+        self.num_outputs = num_outputs
+
+    def forward(self, x):
+        x = x.permute(0, 2, 1)
+        y = self.net(x)
+        return self.fc(y[:, :, -1]).view(-1, self.n_horizons, self.num_outputs)
+
+
+def build_model(num_inputs, num_outputs, horizon, state_dict=None, base_horizon=None):
+    # horizon is an int for single-horizon models and a list for multi-horizon
+    # ones. state_dict may come from a model trained for other horizons
+    # (base_horizon): the trunk is shared and each head block is taken from the
+    # nearest base horizon, or copied from a single-horizon head.
+    if isinstance(horizon, (list, tuple)):
+        model = MultiHorizonTCN(num_inputs, num_outputs, horizon)
+    else:
+        model = TCN(num_inputs, num_outputs)
+    if state_dict is not None:
+        model.load_state_dict(_match_head(state_dict, num_outputs, horizon, base_horizon))
+    return model
+
+
+def _match_head(state_dict, num_outputs, horizon, base_horizon):
+    horizons = list(horizon) if isinstance(horizon, (list, tuple)) else [horizon]
+    weight, bias = state_dict["fc.weight"], state_dict["fc.bias"]
+    n_base = weight.shape[0] // num_outputs
+    if n_base == 1:
+        blocks = [0] * len(horizons)
+    elif isinstance(base_horizon, (list, tuple)) and len(base_horizon) == n_base:
+        blocks = [min(range(n_base), key=lambda i: abs(base_horizon[i] - h)) for h in horizons]
+    elif n_base == len(horizons):
+        blocks = list(range(n_base))
+    else:
+        raise ValueError(f"Cannot map a {n_base}-horizon head onto horizons {horizons}")
+    if blocks == list(range(n_base)):
+        return state_dict
+    state_dict = dict(state_dict)
+    state_dict["fc.weight"] = torch.cat([weight[i * num_outputs:(i + 1) * num_outputs] for i in blocks])
+    state_dict["fc.bias"] = torch.cat([bias[i * num_outputs:(i + 1) * num_outputs] for i in blocks])
+    return state_dict
+
+
+class _GroupedConv(nn.Module):
+    # n independent unpadded stride-1 convs over channel blocks of the input,
+    # as one batched matmul (much faster than a groups=n Conv1d on CPU).
+    def __init__(self, convs):
+        super().__init__()
+        first = convs[0]
+        self.n = len(convs)
+        self.in_channels = first.in_channels
+        self.k = first.kernel_size[0]
+        self.d = first.dilation[0]
+        # (n, in_channels * k, out_channels), rows ordered channel-major like the unfolded input.
+        self.register_buffer("weight", torch.stack([c.weight.detach().reshape(c.out_channels, -1).t() for c in convs]))
+        bias = [c.bias.detach() if c.bias is not None else torch.zeros(c.out_channels) for c in convs]
+        self.register_buffer("bias", torch.stack(bias).unsqueeze(1))
+
+    def forward(self, x):
+        batch, length = x.shape[0], x.shape[2] - (self.k - 1) * self.d
+        cols = torch.stack([x[:, :, i * self.d:i * self.d + length] for i in range(self.k)], -1)
+        cols = cols.reshape(batch, self.n, self.in_channels, length, self.k).permute(1, 0, 3, 2, 4)
+        out = torch.baddbmm(self.bias, cols.reshape(self.n, batch * length, -1), self.weight)
+        return out.reshape(self.n, batch, length, -1).permute(1, 0, 3, 2).reshape(batch, -1, length)
+
+
+class StackedTCN(nn.Module):
+    # Several TCNs with the same layer shapes run as one network over a shared
+    # (batch, seq_len, features) input: the first conv concatenates every
+    # member's filters, later convs run per member as one batched matmul and so
+    # do the heads. forward returns (members, batch, ...) outputs, or their
+    # mean when average=True.
+    #
+    # Each conv only computes the output columns the last output depends on:
+    # _plan() walks back from the newest column (as input_columns does) and
+    # each layer gets an unpadded conv over exactly that range, zero-padded on
+    # the sides where the original conv read its padding.
+    def __init__(self, models, seq_len, average=False):
+        super().__init__()
+        first = models[0]
+        for m in models[1:]:
+            if type(m) is not type(first) or any(
+                p.shape != q.shape for p, q in zip(first.state_dict().values(), m.state_dict().values())
+            ):
+                raise ValueError("Only models with identical architectures can be stacked")
+        layers = []
+        for i, module in enumerate(first.net):
+            if not isinstance(module, nn.Conv1d):
+                layers.append(module)
+                continue
+            if module.groups != 1 or module.stride[0] != 1:
+                raise ValueError("Only stride-1 ungrouped convolutions can be stacked")
+            convs = [m.net[i] for m in models]
+            if layers:
+                layers.append(_GroupedConv(convs))
+                continue
+            conv = nn.Conv1d(
+                module.in_channels, module.out_channels * len(models), module.kernel_size,
+                dilation=module.dilation, bias=module.bias is not None,
+            )
+            with torch.no_grad():
+                conv.weight.copy_(torch.cat([c.weight for c in convs]))
+                if module.bias is not None:
+                    conv.bias.copy_(torch.cat([c.bias for c in convs]))
+            layers.append(conv)
+        self.net = nn.Sequential(*layers)
+        self.input_range, self.pads = self._plan(first, seq_len)
+        self.register_buffer("head_weight", torch.stack([m.fc.weight.detach().t() for m in models]))
+        self.register_buffer("head_bias", torch.stack([m.fc.bias.detach() for m in models]).unsqueeze(1))
+        self.n_models = len(models)
+        self.n_horizons = first.n_horizons if isinstance(first, MultiHorizonTCN) else 0
+        self.average = average
+
+    @staticmethod
+    def _plan(model, seq_len):
+        # Offsets are relative to the newest column (0); [lo, hi] is the range a
+        # layer must produce. Returns the input range and, per module, the
+        # (left, right) zero padding of its input ((0, 0) for activations).
+        modules = list(model.net)
+        lengths = [seq_len]
+        for m in modules:
+            if isinstance(m, nn.Conv1d):
+                lengths.append(lengths[-1] + 2 * m.padding[0] - (m.kernel_size[0] - 1) * m.dilation[0])
+        lo, hi = 0, 0
+        pads = []
+        j = len(lengths) - 1
+        for m in reversed(modules):
+            if not isinstance(m, nn.Conv1d):
+                pads.append((0, 0))
+                continue
+            span = (m.kernel_size[0] - 1) * m.dilation[0]
+            read_lo, read_hi = lo + m.padding[0] - span, hi + m.padding[0]
+            j -= 1
+            lo, hi = max(read_lo, 1 - lengths[j]), min(read_hi, 0)
+            pads.append((lo - read_lo, read_hi - hi))
+        return (lo, hi), pads[::-1]
+
+    def forward(self, x):
+        steps = x.shape[1]
+        x = x[:, steps - 1 + self.input_range[0]:steps + self.input_range[1]].permute(0, 2, 1)
+        for i, module in enumerate(self.net):
+            left, right = self.pads[i]
+            if left or right:
+                x = nn.functional.pad(x, (left, right))
+            x = module(x)
+        y = x[:, :, -1]
+        y = y.reshape(y.shape[0], self.n_models, -1).transpose(0, 1)
+        out = torch.baddbmm(self.head_bias, y, self.head_weight)
+        if self.n_horizons > 0:
+            out = out.reshape(self.n_models, out.shape[1], self.n_horizons, -1)
+        if self.average:
+            return out.mean(0)
+        return out
+
+
+def input_columns(model, seq_len):
+    # Newest input steps the last output actually reads. Everything older only
+    # reaches columns the head never sees, so X[:, -n:] gives the same outputs
+    # and gradients as the full window. With the shipped padding n is 1.
+    if isinstance(model, StackedTCN):
+        # The stacked convs are unpadded; the plan already gives the range read.
+        return min(seq_len, max(1, 1 - model.input_range[0]))
+    convs = [m for m in model.net if isinstance(m, nn.Conv1d)]
+
+    def lengths(n):
+        out = [n]
+        for c in convs:
+            out.append(out[-1] + 2 * c.padding[0] - (c.kernel_size[0] - 1) * c.dilation[0])
+        return out
+
+    # (layer, offset from the newest column); positive offsets are right-hand padding.
+    reads = set()
+
+    def visit(j, r):
+        if r > 0 or (j, r) in reads:
+            return
+        reads.add((j, r))
+        if j:
+            c = convs[j - 1]
+            shift = c.padding[0] - (c.kernel_size[0] - 1) * c.dilation[0]
+            for i in range(c.kernel_size[0]):
+                visit(j - 1, r + shift + i * c.dilation[0])
+
+    visit(len(convs), 0)
+    full = lengths(seq_len)
+    for n in range(1, seq_len):
+        # A read column must exist in the cropped window unless it is left-hand padding in the full one too.
+        cropped = lengths(n)
+        if all(r > -cropped[j] or r <= -full[j] for j, r in reads):
+            return n
+    return seq_len
+
+
+def horizon_tag(horizon):
+    # "6" for a single horizon, "6-12" for a multi-horizon model.
+    if isinstance(horizon, (list, tuple)):
+        return "-".join(str(h) for h in horizon)
+    return str(horizon)
+
+
+class StreamingTCN:
+    # Rolling-window forecasts for many stations, one observation at a time.
+    #
+    # Offsets below are relative to the newest column of each layer (0 = newest,
+    # -1 = one step older). A column of conv layer j is "settled" once none of
+    # its inputs come from the right-hand zero padding, i.e. at offsets
+    # <= -tail[j] with tail[j] = tail[j-1] + padding_j. Settled columns never
+    # change, so they are computed once (when they settle) and cached; columns in
+    # the tail are recomputed on every update. _plan() walks back from the final
+    # output to find which cached columns are actually needed, so each layer
+    # keeps only that much history. For the shipped TCN (padding = (k-1)*dilation
+    # on both sides) the last output only depends on the newest observation and
+    # no history is cached at all.
+
+    def __init__(self, model, mean=None, scale=None):
+        modules = list(model.net)
+        self.layers = []
+        for i, m in enumerate(modules):
+            if not isinstance(m, nn.Conv1d):
+                continue
+            act = modules[i + 1] if i + 1 < len(modules) and not isinstance(modules[i + 1], nn.Conv1d) else None
+            self.layers.append({
+                "weight": m.weight.detach().float(),
+                "bias": m.bias.detach().float() if m.bias is not None else None,
+                "k": m.kernel_size[0],
+                "d": m.dilation[0],
+                "p": m.padding[0],
+                "act": act,
+            })
+        self.fc = model.fc
+        self.out_shape = (model.n_horizons, model.num_outputs) if isinstance(model, MultiHorizonTCN) else None
+        self.channels = [self.layers[0]["weight"].shape[1]] + [l["weight"].shape[0] for l in self.layers]
+        self.tail = [0]
+        for layer in self.layers:
+            self.tail.append(self.tail[-1] + layer["p"])
+        self.history = self._plan()
+
+        self.mean = None if mean is None else torch.as_tensor(mean, dtype=torch.float32)
+        self.inv_scale = None if scale is None else 1.0 / torch.as_tensor(scale, dtype=torch.float32)
+
+        self.index = {}
+        self.counts = torch.zeros(0, dtype=torch.int64)
+        self.buffers = [torch.zeros(0, h, c) for h, c in zip(self.history, self.channels)]
+
+    def _taps(self, j, r):
+        # Offsets in layer j-1 read by column r of layer j; positive offsets are zero padding.
+        layer = self.layers[j - 1]
+        shift = layer["p"] - (layer["k"] - 1) * layer["d"]
+        return [r + shift + i * layer["d"] for i in range(layer["k"])]
+
+    def _plan(self):
+        n = len(self.layers)
+        requests = [set() for _ in range(n + 1)]
+
+        def visit(j, r):
+            if r > 0:
+                return
+            if j == 0 or r <= -self.tail[j]:
+                requests[j].add(r)
+                return
+            for rr in self._taps(j, r):
+                visit(j - 1, rr)
+
+        visit(n, 0)
+        history = [0] * (n + 1)
+        for j in range(n, 0, -1):
+            if requests[j]:
+                history[j] = -self.tail[j] - min(requests[j]) + 1
+                # Keeping layer j's cache current means settling one column per update.
+                for rr in self._taps(j, -self.tail[j]):
+                    visit(j - 1, rr)
+        history[0] = -min(requests[0]) + 1 if requests[0] else 1
+        return history
+
+    def _rows(self, station_ids):
+        new = [s for s in dict.fromkeys(station_ids) if s not in self.index]
+        if new:
+            start = len(self.index)
+            for i, s in enumerate(new):
+                self.index[s] = start + i
+            needed = len(self.index)
+            if needed > len(self.counts):
+                capacity = max(needed, 2 * len(self.counts), 16)
+                grow = capacity - len(self.counts)
+                self.counts = torch.cat([self.counts, torch.zeros(grow, dtype=torch.int64)])
+                self.buffers = [
+                    torch.cat([buf, torch.zeros(grow, buf.shape[1], buf.shape[2])]) for buf in self.buffers
+                ]
+        return torch.tensor([self.index[s] for s in station_ids], dtype=torch.int64)
+
+    def _column(self, j, r, rows, memo):
+        if r > 0:
+            return torch.zeros(len(rows), self.channels[j])
+        if j == 0 or r <= -self.tail[j]:
+            h = self.history[j]
+            return self.buffers[j][rows, h - 1 - (-self.tail[j] - r)]
+        key = (j, r)
+        if key not in memo:
+            memo[key] = self._conv(j, [self._column(j - 1, rr, rows, memo) for rr in self._taps(j, r)])
+        return memo[key]
+
+    def _conv(self, j, inputs):
+        layer = self.layers[j - 1]
+        out = sum(x @ layer["weight"][:, :, i].T for i, x in enumerate(inputs))
+        if layer["bias"] is not None:
+            out = out + layer["bias"]
+        return layer["act"](out) if layer["act"] is not None else out
+
+    def _push(self, j, rows, column):
+        buf = self.buffers[j]
+        if buf.shape[1] == 0:
+            return
+        buf[rows, :-1] = buf[rows, 1:].clone()
+        buf[rows, -1] = column
+
+    @torch.inference_mode()
+    def update(self, station_ids, observations):
+        # observations: (len(station_ids), n_features) raw values, one new step
+        # per station. Returns (predictions, ready); ready marks stations whose
+        # history already covers the model's receptive field.
+        station_ids = list(station_ids)
+        if len(set(station_ids)) != len(station_ids):
+            raise ValueError("Each station can only be updated once per call")
+        rows = self._rows(station_ids)
+        x = torch.as_tensor(np.asarray(observations), dtype=torch.float32)
+        if self.mean is not None:
+            x = (x - self.mean) * self.inv_scale
+
+        self._push(0, rows, x)
+        for j in range(1, len(self.layers) + 1):
+            if self.history[j]:
+                taps = [self._column(j - 1, rr, rows, {}) for rr in self._taps(j, -self.tail[j])]
+                self._push(j, rows, self._conv(j, taps))
+        self.counts[rows] += 1
+
+        out = self._column(len(self.layers), 0, rows, {})
+        preds = self.fc(out).numpy()
+        if self.out_shape is not None:
+            preds = preds.reshape((len(rows),) + self.out_shape)
+        return preds, (self.counts[rows] >= self.receptive_field()).numpy()
+
+    def receptive_field(self):
+        return sum((l["k"] - 1) * l["d"] for l in self.layers) + 1
+
+    def reset(self, station_ids):
+        rows = torch.tensor([self.index[s] for s in station_ids if s in self.index], dtype=torch.int64)
+        self.counts[rows] = 0
+        for buf in self.buffers:
+            buf[rows] = 0
+
+    def memory_bytes(self):
+        return sum(buf.element_size() * buf.nelement() for buf in self.buffers) + self.counts.element_size() * self.counts.nelement()
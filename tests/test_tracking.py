@@ -0,0 +1,97 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracking
+
+
+class FakeClient:
+    # Stands in for MlflowClient; raises while `down` is set.
+    def __init__(self):
+        self.down = False
+        self.calls = []
+        self.runs = 0
+
+    def _call(self, name, *args):
+        if self.down:
+            raise ConnectionError("tracking server down")
+        self.calls.append((name,) + args)
+
+    def get_experiment_by_name(self, name):
+        self._call("get_experiment_by_name", name)
+        return None
+
+    def create_experiment(self, name):
+        self._call("create_experiment", name)
+        return "0"
+
+    def create_run(self, experiment_id, start_time=None, run_name=None, tags=None):
+        self._call("create_run", run_name)
+        self.runs += 1
+
+        class Info:
+            run_id = f"server-run-{self.runs}"
+
+        class Created:
+            info = Info()
+        return Created()
+
+    def log_batch(self, run_id, metrics=(), params=()):
+        self._call("log_batch", run_id, [(m.key, m.value, m.step) for m in metrics])
+
+    def set_terminated(self, run_id, status=None, end_time=None):
+        self._call("set_terminated", run_id, status)
+
+
+def make_writer(client, buffer_dir, monkeypatch):
+    monkeypatch.setattr(tracking, "TRACKING_BUFFER_DIR", str(buffer_dir))
+    writer = tracking._Writer()
+    writer.buffer_path = os.path.join(str(buffer_dir), os.path.basename(writer.buffer_path))
+    writer.client = client
+    return writer
+
+
+def run_events(run="r1"):
+    start = {"op": "start", "run": run, "experiment": "exp", "run_name": "Inc_case", "tags": {}, "time": 1}
+    metrics = {"op": "metrics", "run": run, "metrics": [["loss", 0.5, 2, 1], ["loss", 0.25, 3, 2]]}
+    end = {"op": "end", "run": run, "status": "FINISHED", "time": 4}
+    return start, metrics, end
+
+
+def test_run_spanning_an_outage_is_replayed_whole(tmp_path, monkeypatch):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, monkeypatch)
+    start, metrics, end = run_events()
+
+    # The server is down when the run starts, so its start event is buffered.
+    client.down = True
+    writer.deliver([start])
+    assert "r1" not in writer.run_ids
+
+    # It is back before the run ends; the rest of the run must not go out live
+    # without a server run id.
+    client.down = False
+    writer.offline_until = 0.0
+    writer.deliver([metrics, end])
+    assert client.calls == []
+
+    replayer = make_writer(FakeClient(), tmp_path, monkeypatch)
+    replayer.replay(str(tmp_path))
+    names = [c[0] for c in replayer.client.calls]
+    assert names[-3:] == ["create_run", "log_batch", "set_terminated"]
+    log_batch = replayer.client.calls[-2]
+    assert log_batch[1] == "server-run-1"
+    assert log_batch[2] == [("loss", 0.5, 1), ("loss", 0.25, 2)]
+    assert replayer.client.calls[-1] == ("set_terminated", "server-run-1", "FINISHED")
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".jsonl") and "r1" in open(tmp_path / f).read()]
+
+
+def test_runs_started_online_keep_logging_live(tmp_path, monkeypatch):
+    client = FakeClient()
+    writer = make_writer(client, tmp_path, monkeypatch)
+    start, metrics, end = run_events("r2")
+
+    writer.deliver([start, metrics, end])
+    assert [c[0] for c in client.calls][-3:] == ["create_run", "log_batch", "set_terminated"]
+    assert not os.listdir(tmp_path)
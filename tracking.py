@@ -0,0 +1,315 @@
+import os
+import json
+import glob
+import time
+import uuid
+import queue
+import atexit
+import socket
+import argparse
+import threading
+
+# Non-blocking MLflow logging shared by the pipeline scripts. Calls on a Run
+# only queue events; a background thread sends them in log_batch calls. When
+# the tracking server is down the events are appended to a JSONL file in
+# TRACKING_BUFFER_DIR, and replay() sends them later.
+MLFLOW_TRACKING_URI = os.environ.get("MLFLOW_TRACKING_URI", "https://mlflow.neikoscloud.net")
+TRACKING_BUFFER_DIR = os.environ.get("TRACKING_BUFFER_DIR", "mlflow_buffer")
+TRACKING_FLUSH_INTERVAL = float(os.environ.get("TRACKING_FLUSH_INTERVAL", "2"))
+# After a failed request everything goes straight to disk for this long.
+TRACKING_RETRY_SECONDS = float(os.environ.get("TRACKING_RETRY_SECONDS", "300"))
+TRACKING_BATCH_EVENTS = 500
+# The MLflow client otherwise retries 7 times with a 120s timeout per request.
+HTTP_TIMEOUT = os.environ.get("TRACKING_HTTP_TIMEOUT", "10")
+HTTP_MAX_RETRIES = os.environ.get("TRACKING_HTTP_MAX_RETRIES", "1")
+# log_batch limits of the MLflow REST API.
+MAX_BATCH_METRICS = 1000
+MAX_BATCH_PARAMS = 100
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _short(error):
+    return f"{type(error).__name__}: {str(error)[:120]}"
+
+
+class Run:
+    # A handle for one MLflow run; the server-side run is created by the writer.
+    def __init__(self, experiment, run_name, tags=None):
+        self.id = uuid.uuid4().hex
+        self.status = None
+        _submit({
+            "op": "start", "run": self.id, "experiment": experiment, "run_name": run_name,
+            "tags": {k: str(v) for k, v in (tags or {}).items()}, "time": _now_ms(),
+        })
+
+    def log_params(self, params):
+        _submit({"op": "params", "run": self.id, "params": {k: str(v) for k, v in params.items()}})
+
+    def log_param(self, key, value):
+        self.log_params({key: value})
+
+    def log_metrics(self, metrics, step=0):
+        now = _now_ms()
+        _submit({
+            "op": "metrics", "run": self.id,
+            "metrics": [[k, float(v), now, int(step)] for k, v in metrics.items()],
+        })
+
+    def log_metric(self, key, value, step=0):
+        self.log_metrics({key: value}, step)
+
+    def log_curve(self, key, values, first_step=1):
+        # A whole series in one event, e.g. per-epoch losses.
+        now = _now_ms()
+        _submit({
+            "op": "metrics", "run": self.id,
+            "metrics": [[key, float(v), now, first_step + i] for i, v in enumerate(values)],
+        })
+
+    def end(self, status="FINISHED"):
+        if self.status is None:
+            self.status = status
+            _submit({"op": "end", "run": self.id, "status": status, "time": _now_ms()})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end("FAILED" if exc_type is not None else "FINISHED")
+        return False
+
+
+def start_run(experiment, run_name, tags=None):
+    return Run(experiment, run_name, tags)
+
+
+class _Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True, name="mlflow-writer")
+        self.queue = queue.Queue()
+        self.client = None
+        self.experiments = {}
+        self.run_ids = {}
+        # Runs whose start event went to the buffer: they have no server id in
+        # this process, so all their later events are buffered too and replay
+        # sends the whole run in order.
+        self.buffered_runs = set()
+        self.offline_until = 0.0
+        # The uuid part keeps writers created within the same second apart.
+        self.buffer_path = os.path.join(
+            TRACKING_BUFFER_DIR, f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}-{uuid.uuid4().hex[:8]}.jsonl"
+        )
+
+    def run(self):
+        while True:
+            events = [self.queue.get()]
+            deadline = time.monotonic() + TRACKING_FLUSH_INTERVAL
+            while len(events) < TRACKING_BATCH_EVENTS and events[-1]["op"] not in ("flush", "replay"):
+                try:
+                    events.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                log_events = [e for e in events if e["op"] not in ("flush", "replay")]
+                if log_events:
+                    self.deliver(log_events)
+                if events[-1]["op"] == "replay":
+                    self.replay(events[-1]["buffer_dir"])
+            except Exception as e:
+                print(f"[tracking] Writer error: {e}")
+            finally:
+                for _ in events:
+                    self.queue.task_done()
+
+    def connect(self):
+        if self.client is None:
+            os.environ.setdefault("MLFLOW_HTTP_REQUEST_TIMEOUT", HTTP_TIMEOUT)
+            os.environ.setdefault("MLFLOW_HTTP_REQUEST_MAX_RETRIES", HTTP_MAX_RETRIES)
+            from mlflow.tracking import MlflowClient
+            self.client = MlflowClient(tracking_uri=MLFLOW_TRACKING_URI)
+        return self.client
+
+    def deliver(self, events):
+        if time.monotonic() < self.offline_until:
+            self.buffer(events)
+            return
+        held = [e for e in events if e["run"] in self.buffered_runs]
+        if held:
+            self.buffer(held)
+            events = [e for e in events if e["run"] not in self.buffered_runs]
+            if not events:
+                return
+        unsent, error = send_events(self, events, self.run_ids)
+        if unsent:
+            print(f"[tracking] MLflow unreachable ({_short(error)}), buffering {len(unsent)} events to {TRACKING_BUFFER_DIR}")
+            self.offline_until = time.monotonic() + TRACKING_RETRY_SECONDS
+            self.buffer(unsent)
+
+    def buffer(self, events):
+        os.makedirs(TRACKING_BUFFER_DIR, exist_ok=True)
+        with open(self.buffer_path, "a", encoding="utf-8") as f:
+            for e in events:
+                if e["run"] not in self.run_ids:
+                    self.buffered_runs.add(e["run"])
+                elif e["op"] != "start":
+                    # The run already exists on the server; replay logs into it.
+                    e = dict(e, run_id=self.run_ids[e["run"]])
+                f.write(json.dumps(e) + "\n")
+
+    def replay(self, buffer_dir):
+        if time.monotonic() < self.offline_until:
+            return
+        for path in sorted(glob.glob(os.path.join(buffer_dir, "*.jsonl"))):
+            if os.path.abspath(path) == os.path.abspath(self.buffer_path):
+                continue
+            # Claim the file so two processes never replay the same events.
+            claimed = f"{path}.{os.getpid()}"
+            try:
+                os.replace(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                events = [json.loads(line) for line in f if line.strip()]
+            unsent, error = send_events(self, events, {})
+            if unsent:
+                with open(path, "w", encoding="utf-8") as f:
+                    for e in unsent:
+                        f.write(json.dumps(e) + "\n")
+                os.remove(claimed)
+                print(f"[tracking] Replay of {path} stopped ({_short(error)}), {len(unsent)} events kept")
+                self.offline_until = time.monotonic() + TRACKING_RETRY_SECONDS
+                return
+            os.remove(claimed)
+            print(f"[tracking] Replayed {len(events)} buffered events from {path}")
+
+
+def _experiment_id(writer, name):
+    if name not in writer.experiments:
+        client = writer.connect()
+        experiment = client.get_experiment_by_name(name)
+        writer.experiments[name] = experiment.experiment_id if experiment else client.create_experiment(name)
+    return writer.experiments[name]
+
+
+def send_events(writer, events, run_ids):
+    # Sends events in order, merging consecutive params/metrics of a run into
+    # log_batch calls. Returns (unsent events, error); unsent events carry the
+    # server run_id when the run was already created.
+    from mlflow.entities import Metric, Param, RunTag
+
+    sent = set()
+    pending = {}
+
+    def run_id(e):
+        return run_ids.get(e["run"]) or e.get("run_id")
+
+    def flush_run(run):
+        metrics, params, idx = pending.pop(run, ([], {}, []))
+        if not idx:
+            return
+        rid = run_ids.get(run) or events[idx[0]].get("run_id")
+        if rid is None:
+            # The start event was lost (e.g. a truncated buffer file).
+            print(f"[tracking] Dropping {len(idx)} events for an unknown run")
+            sent.update(idx)
+            return
+        client = writer.connect()
+        params = [Param(k, v) for k, v in params.items()]
+        metrics = [Metric(*m) for m in metrics]
+        while params or metrics:
+            batch_params, params = params[:MAX_BATCH_PARAMS], params[MAX_BATCH_PARAMS:]
+            n_metrics = MAX_BATCH_METRICS - len(batch_params)
+            batch_metrics, metrics = metrics[:n_metrics], metrics[n_metrics:]
+            client.log_batch(rid, metrics=batch_metrics, params=batch_params)
+        sent.update(idx)
+
+    try:
+        for i, e in enumerate(events):
+            run = e["run"]
+            if e["op"] == "start":
+                client = writer.connect()
+                created = client.create_run(
+                    _experiment_id(writer, e["experiment"]), start_time=e["time"], run_name=e["run_name"],
+                    tags=[RunTag(k, v) for k, v in e["tags"].items()] or None,
+                )
+                run_ids[run] = created.info.run_id
+                sent.add(i)
+            elif e["op"] == "end":
+                flush_run(run)
+                if run_id(e) is not None:
+                    writer.connect().set_terminated(run_id(e), status=e["status"], end_time=e["time"])
+                sent.add(i)
+            else:
+                metrics, params, idx = pending.setdefault(run, ([], {}, []))
+                metrics.extend(e.get("metrics", []))
+                params.update(e.get("params", {}))
+                idx.append(i)
+        for run in list(pending):
+            flush_run(run)
+        return [], None
+    except Exception as error:
+        unsent = []
+        for i, e in enumerate(events):
+            if i in sent:
+                continue
+            if e["op"] != "start" and run_ids.get(e["run"]):
+                e = dict(e, run_id=run_ids[e["run"]])
+            unsent.append(e)
+        return unsent, error
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = _Writer()
+            _writer.start()
+        return _writer
+
+
+def _submit(event):
+    _get_writer().queue.put(event)
+
+
+def flush(timeout=None):
+    # Blocks until every queued event has been sent or buffered to disk.
+    if _writer is None:
+        return True
+    _writer.queue.put({"op": "flush"})
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _writer.queue.all_tasks_done:
+        while _writer.queue.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            _writer.queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def replay(buffer_dir=TRACKING_BUFFER_DIR):
+    # Queues a replay of events buffered by earlier runs; it runs on the writer
+    # thread, so callers are not blocked.
+    if glob.glob(os.path.join(buffer_dir, "*.jsonl")):
+        _submit({"op": "replay", "buffer_dir": buffer_dir})
+
+
+# Spawned pool workers exit without running atexit handlers, so they call flush() themselves.
+atexit.register(flush)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buffer-dir", default=TRACKING_BUFFER_DIR, help="Directory with buffered .jsonl events")
+    args = parser.parse_args()
+
+    replay(args.buffer_dir)
+    flush()
+    left = glob.glob(os.path.join(args.buffer_dir, "*.jsonl"))
+    print(f"[tracking] {len(left)} buffer files left in {args.buffer_dir}")
@@ -1,39 +1,64 @@
 import itertools
 import os
+import io
+import math
+import argparse
+import multiprocessing
 import time
 import torch
 import torch.nn as nn
 import pandas as pd
 import numpy as np
-import mlflow
 import shutil
 import glob
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.preprocessing import StandardScaler
 from torch.utils.data import TensorDataset, DataLoader
-
-
-class TCN(nn.Module):
-    def __init__(self, num_inputs, num_outputs):
-        super().__init__()
-        self.net = nn.Sequential(
-            nn.Conv1d(num_inputs, 32, 3, padding=2, dilation=1),
-            nn.ReLU(),
-            nn.Conv1d(32, 64, 3, padding=4, dilation=2),
-            nn.ReLU(),
-        )
-        self.fc = nn.Linear(64, num_outputs)
-
-    def forward(self, x):
-        x = x.permute(0, 2, 1)
-        y = self.net(x)
-        return self.fc(y[:, :, -1])
+from windowing import create_sequences
+from ingest import read_weather_csv, shifted_targets
+from checkpoint import CHECKPOINT_EXT, load_checkpoint, save_checkpoint
+from tcn import build_model, horizon_tag, input_columns
+from history_store import HISTORY_DIR, HistoryStore
+import instrumentation
+import tracking
+import s3io
 
 
 SEQ_LENS = [24]
 HORIZONS = [6, 12]
+# One model with a shared trunk and a head per horizon instead of one model
+# per horizon (TRAIN_MULTI_HORIZON=1 or --multi-horizon).
+MULTI_HORIZON = os.environ.get("TRAIN_MULTI_HORIZON", "0") == "1"
 EPOCHS = [30, 50]
 BATCH_SIZES = [8, 16, 32]
 
+# Successive halving: configs sharing (seq_len, horizon, batch_size) are trained
+# as one lineage that checkpoints at every EPOCHS value, and lineages are
+# ranked on a chronological holdout at epochs SH_MIN_EPOCHS * SH_ETA**k, each
+# against the others of its (seq_len, horizon). SH_MIN_SURVIVORS is split
+# across those brackets.
+SH_MIN_EPOCHS = 5
+SH_ETA = 2
+SH_MIN_SURVIVORS = 3
+HOLDOUT_FRACTION = 0.1
+
+# fast: slice shuffled index batches straight out of the prepared tensors and
+# sync the loss to the host once per epoch; loader: the DataLoader loop.
+TRAIN_LOOP = os.environ.get("TRAIN_LOOP", "fast")
+# bf16 runs the forward pass under autocast (fast loop only; pays off on CPUs
+# with AMX/AVX512-BF16 and on GPUs). fp32 matches the loader loop's losses.
+TRAIN_PRECISION = os.environ.get("TRAIN_PRECISION", "fp32")
+TRAIN_COMPILE = os.environ.get("TRAIN_COMPILE", "0") == "1"
+
+# Every day's data is appended to the history store (history_store.py).
+# TRAIN_REFRESH_SCALER=1 scales inputs with its running statistics instead of
+# the base checkpoint's scaler. TRAIN_REPLAY_FRACTION adds that many windows
+# from earlier days (relative to today's) to every epoch; fast loop only.
+TRAIN_HISTORY = os.environ.get("TRAIN_HISTORY", "1") == "1"
+TRAIN_REFRESH_SCALER = os.environ.get("TRAIN_REFRESH_SCALER", "0") == "1"
+TRAIN_REPLAY_FRACTION = float(os.environ.get("TRAIN_REPLAY_FRACTION", "0"))
+
 TARGETS = [
     "temperature", "feels_like", "humidity", "wind_speed", "gust_speed", "pressure", "precipitation",
     "rain_probability", "snow_probability", "uv_index", "dewpoint", "visibility", "cloud"
@@ -43,141 +68,565 @@ TARGETS = [
 BASE_MODEL_DIR = "./" 
 INC_MODEL_DIR = "models_incremental"
 EXPERIMENT_NAME = "weather_incremental_training"
-os.environ["MLFLOW_TRACKING_URI"] = "https://mlflow.neikoscloud.net"
-
 
-def create_sequences(X, y, seq_len):
-    xs, ys = [], []
-    for i in range(len(X) - seq_len):
-        xs.append(X[i:i + seq_len])
-        ys.append(y[i + seq_len - 1])
-    return np.array(xs), np.array(ys)
 
 def prepare_data_incremental(df, features, targets, horizon, seq_len, scaler_X):
-    df = df.copy()
-    for t in targets:
-        df[f"{t}_y"] = df[t].shift(-horizon)
-    df.dropna(inplace=True)
-    
-    X = scaler_X.transform(df[features].values)
-    y = df[[f"{t}_y" for t in targets]].values
+    X_raw, y, _ = shifted_targets(df, features, targets, horizon)
+    X = scaler_X.transform(X_raw)
     
     X_seq, y_seq = create_sequences(X, y, seq_len)
     return X_seq, y_seq
 
 
-def train_incremental_case(df, features, cfg, base_checkpoint_path):
-    name = f"h{cfg['horizon']}_ep{cfg['epochs']}_bs{cfg['batch_size']}"
+# Shared across grid cases: the windowed tensors only depend on the data,
+# seq_len, horizon and scaler, not on epochs or batch size.
+_CHECKPOINT_CACHE = {}
+_DATASET_CACHE = {}
+_HISTORY_CACHE = {}
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dataframe_hash(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+
+
+def load_base_checkpoint(path, device):
+    key = (os.path.abspath(path), os.path.getmtime(path), str(device))
+    if key not in _CHECKPOINT_CACHE:
+        _CHECKPOINT_CACHE[key] = load_checkpoint(path, map_location=device)
+    return _CHECKPOINT_CACHE[key]
+
+
+def scaler_from_checkpoint(checkpoint, features):
+    scaler_X = StandardScaler()
+    scaler_X.mean_ = np.array(checkpoint["scaler_mean"])
+    scaler_X.scale_ = np.array(checkpoint["scaler_scale"])
+    scaler_X.n_features_in_ = len(features)
+    return scaler_X
+
+
+def history_store():
+    # Opened once per process (after the parent appended today's shard); None
+    # while the store is empty.
+    if "store" not in _HISTORY_CACHE:
+        try:
+            _HISTORY_CACHE["store"] = HistoryStore(HISTORY_DIR)
+        except FileNotFoundError:
+            return None
+    return _HISTORY_CACHE["store"]
+
+
+def training_scaler(checkpoint, features):
+    store = history_store() if TRAIN_REFRESH_SCALER else None
+    if store is not None and store.shards:
+        return store.scaler(features)
+    return scaler_from_checkpoint(checkpoint, features)
+
+
+def replay_sampler(features, cfg, scaler_X, n_train, data_key, fraction=TRAIN_REPLAY_FRACTION):
+    # Returns (sample(steps) -> (X, y) arrays, windows per epoch), or (None, 0)
+    # when there is nothing to replay. Today's shard is excluded.
+    store = history_store() if fraction > 0 else None
+    n = int(fraction * n_train)
+    if store is None or n <= 0:
+        return None, 0
+    if store.count_windows(features, TARGETS, cfg["horizon"], cfg["seq_len"], exclude={data_key}) == 0:
+        return None, 0
+    rng = np.random.default_rng()
+
+    def sample(steps):
+        return store.replay_batch(
+            rng, n, features, TARGETS, cfg["horizon"], cfg["seq_len"], scaler_X, last_steps=steps,
+            exclude={data_key},
+        )
+    return sample, n
+
+
+def checkpoint_horizon(checkpoint):
+    return checkpoint.get("horizon", checkpoint.get("config", {}).get("horizon"))
+
+
+def get_prepared_dataset(df, data_key, features, seq_len, horizon, scaler_X, device):
+    scaler_key = hashlib.sha256(
+        np.ascontiguousarray(scaler_X.mean_).tobytes() + np.ascontiguousarray(scaler_X.scale_).tobytes()
+    ).hexdigest()
+    key = (data_key, seq_len, horizon_tag(horizon), scaler_key, tuple(features), str(device))
+    if key in _DATASET_CACHE:
+        return _DATASET_CACHE[key]
+
+    with instrumentation.timed("prepare_dataset"):
+        X_seq, y_seq = prepare_data_incremental(df, features, TARGETS, horizon, seq_len, scaler_X)
+        X_tensor = torch.tensor(X_seq, dtype=torch.float32).to(device)
+        y_tensor = torch.tensor(y_seq, dtype=torch.float32).to(device)
+    _DATASET_CACHE[key] = (X_tensor, y_tensor)
+    print(f"Prepared dataset (seq_len={seq_len}, horizon={horizon}): {len(X_tensor)} windows")
+    return X_tensor, y_tensor
+
+
+def case_name(cfg):
+    return f"h{horizon_tag(cfg['horizon'])}_ep{cfg['epochs']}_bs{cfg['batch_size']}"
+
+
+def train_one_epoch(model, optimizer, loss_fn, loader):
+    epoch_loss = 0.0
+    for xb, yb in loader:
+        optimizer.zero_grad()
+        pred = model(xb)
+        loss = loss_fn(pred, yb)
+        loss.backward()
+        optimizer.step()
+        epoch_loss += loss.item()
+    return epoch_loss / len(loader)
+
+
+def make_optimizer(model, loop=TRAIN_LOOP):
+    # The fused Adam kernel updates all parameters in one call per step. It
+    # only exists for CPU tensors from torch 2.4 on; older versions refuse it
+    # at construction and get the default implementation.
+    params = list(model.parameters())
+    if loop == "fast":
+        try:
+            return torch.optim.Adam(params, lr=1e-4, fused=True)
+        except (RuntimeError, TypeError):
+            pass
+    return torch.optim.Adam(params, lr=1e-4)
+
+
+def train_epoch_fast(model, optimizer, loss_fn, X, y, batch_size, precision=TRAIN_PRECISION):
+    # Same mean batch loss as train_one_epoch, without the DataLoader collate
+    # and the per-batch .item() sync.
+    batches = torch.randperm(len(X), device=X.device).split(batch_size)
+    epoch_loss = torch.zeros((), dtype=torch.float64, device=X.device)
+    for idx in batches:
+        optimizer.zero_grad()
+        with torch.autocast(X.device.type, dtype=torch.bfloat16, enabled=precision == "bf16"):
+            pred = model(X[idx])
+        loss = loss_fn(pred.float(), y[idx])
+        loss.backward()
+        optimizer.step()
+        epoch_loss += loss.detach()
+    return epoch_loss.item() / len(batches)
+
+
+def epoch_runner(model, optimizer, loss_fn, X, y, batch_size, loop=TRAIN_LOOP, precision=TRAIN_PRECISION,
+                 compile_model=TRAIN_COMPILE, replay=None):
+    # Returns a callable training one epoch and returning its mean loss.
+    # replay(steps) gives extra (X, y) windows mixed into each epoch.
+    if loop == "loader":
+        loader = DataLoader(TensorDataset(X, y), batch_size=batch_size, shuffle=True)
+        return lambda: train_one_epoch(model, optimizer, loss_fn, loader)
+    # Only the steps the last output reads are gathered per batch.
+    steps = input_columns(model, X.shape[1])
+    X = X[:, -steps:]
+    # The compiled wrapper shares parameters with model, so model.state_dict()
+    # keeps its usual keys for checkpoints.
+    step_model = torch.compile(model) if compile_model else model
+    if replay is None:
+        return lambda: train_epoch_fast(step_model, optimizer, loss_fn, X, y, batch_size, precision)
+
+    def run():
+        X_old, y_old = replay(steps)
+        X_all = torch.cat([X, torch.from_numpy(X_old).to(X.device)])
+        y_all = torch.cat([y, torch.from_numpy(y_old).to(y.device)])
+        return train_epoch_fast(step_model, optimizer, loss_fn, X_all, y_all, batch_size, precision)
+    return run
+
+
+def average_last_losses(loss_values):
+    return np.mean(loss_values[-5:]) if len(loss_values) >= 5 else np.mean(loss_values)
+
+
+def save_incremental_model(model, features, cfg, scaler_X):
+    os.makedirs(INC_MODEL_DIR, exist_ok=True)
+    save_path = f"{INC_MODEL_DIR}/{case_name(cfg)}{CHECKPOINT_EXT}"
+
+    save_checkpoint(save_path, model.state_dict(), {
+        "features": features,
+        "targets": TARGETS,
+        "seq_len": cfg["seq_len"],
+        "horizon": cfg["horizon"],
+        "scaler_mean": scaler_X.mean_.tolist(),
+        "scaler_scale": scaler_X.scale_.tolist(),
+        "config": cfg,
+    })
+    return save_path
+
+
+def train_incremental_case(df, features, cfg, base_checkpoint_path, data_key=None):
+    name = case_name(cfg)
     print(f"\nFine-tuning case: {name}")
 
     if not os.path.exists(base_checkpoint_path):
         print(f"The original model could not be found at {base_checkpoint_path}. Skipping this case.")
         return None
-    mlflow.set_tracking_uri(os.environ.get("MLFLOW_TRACKING_URI"))
-    mlflow.set_experiment(EXPERIMENT_NAME)
-
-    mlflow.start_run(run_name=f"Inc_{name}")
-    try:
+    with tracking.start_run(EXPERIMENT_NAME, f"Inc_{name}") as run:
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        mlflow.log_params(cfg)
+        run.log_params(cfg)
 
-        checkpoint = torch.load(base_checkpoint_path, map_location=device, weights_only=False)
-        
-        scaler_X = StandardScaler()
-        scaler_X.mean_ = np.array(checkpoint["scaler_mean"])
-        scaler_X.scale_ = np.array(checkpoint["scaler_scale"])
-        scaler_X.n_features_in_ = len(features)
+        checkpoint = load_base_checkpoint(base_checkpoint_path, device)
+        scaler_X = training_scaler(checkpoint, features)
 
-        X_seq, y_seq = prepare_data_incremental(
-            df, features, TARGETS, cfg["horizon"], cfg["seq_len"], scaler_X
+        if data_key is None:
+            data_key = dataframe_hash(df)
+        X_tensor, y_tensor = get_prepared_dataset(
+            df, data_key, features, cfg["seq_len"], cfg["horizon"], scaler_X, device
         )
         
-        if len(X_seq) == 0:
+        if len(X_tensor) == 0:
             return None
 
-        X_tensor = torch.tensor(X_seq, dtype=torch.float32).to(device)
-        y_tensor = torch.tensor(y_seq, dtype=torch.float32).to(device)
-        loader = DataLoader(TensorDataset(X_tensor, y_tensor), batch_size=cfg["batch_size"], shuffle=True)
-
-        model = TCN(len(features), len(TARGETS)).to(device)
-        model.load_state_dict(checkpoint["state_dict"])
+        model = build_model(
+            len(features), len(TARGETS), cfg["horizon"], checkpoint["state_dict"], checkpoint_horizon(checkpoint)
+        ).to(device)
         
-        optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+        optimizer = make_optimizer(model)
         loss_fn = nn.MSELoss()
+        replay, n_replay = replay_sampler(features, cfg, scaler_X, len(X_tensor), data_key)
+        run_epoch = epoch_runner(model, optimizer, loss_fn, X_tensor, y_tensor, cfg["batch_size"], replay=replay)
+        n_samples = len(X_tensor) + n_replay
 
         loss_values = []
         model.train()
         for ep in range(cfg["epochs"]):
-            epoch_loss = 0.0
-            for xb, yb in loader:
-                optimizer.zero_grad()
-                pred = model(xb)
-                loss = loss_fn(pred, yb)
-                loss.backward()
-                optimizer.step()
-                epoch_loss += loss.item()
-            
-            epoch_loss /= len(loader)
+            start = time.perf_counter()
+            epoch_loss = run_epoch()
+            seconds = time.perf_counter() - start
+            instrumentation.record_epoch(name, ep + 1, n_samples, seconds)
             loss_values.append(epoch_loss)
+            run.log_metric("loss", epoch_loss, step=ep + 1)
             if (ep + 1) % 5 == 0:
-                print(f"[{name}] Epoch {ep+1}/{cfg['epochs']} | Loss: {epoch_loss:.4f}")
+                print(f"[{name}] Epoch {ep+1}/{cfg['epochs']} | Loss: {epoch_loss:.4f} | {n_samples / seconds:.0f} samples/s")
+
+        run.log_metric("mse_inc", epoch_loss)
+        save_incremental_model(model, features, cfg, scaler_X)
+        return average_last_losses(loss_values)
+
+
+# Per-process state for grid workers, set once by the pool initializer so the
+# dataframe is sent to each worker only once instead of with every case.
+_WORKER_STATE = {}
+
+
+def _init_grid_worker(df, features, base_checkpoint_path, data_key, torch_threads):
+    torch.set_num_threads(torch_threads)
+    _WORKER_STATE.update(
+        df=df, features=features, base_checkpoint_path=base_checkpoint_path, data_key=data_key
+    )
+
+
+def _run_grid_case(cfg):
+    state = _WORKER_STATE
+    loss = train_incremental_case(
+        state["df"], state["features"], cfg, state["base_checkpoint_path"], state["data_key"]
+    )
+    # Workers exit without atexit handlers, so queued MLflow events are sent here.
+    tracking.flush()
+    # Timings collected in the worker travel back with the result.
+    return cfg, loss, instrumentation.drain()
+
+
+def default_grid_workers(n_cases, torch_threads):
+    return max(1, min(n_cases, (os.cpu_count() or 1) // torch_threads))
+
+
+def run_grid(df, features, cases, base_checkpoint_path, data_key, workers=1, torch_threads=1):
+    # Returns (cfg, loss) pairs in the same order as cases.
+    if workers <= 1 or len(cases) <= 1:
+        torch.set_num_threads(torch_threads)
+        return [(cfg, train_incremental_case(df, features, cfg, base_checkpoint_path, data_key)) for cfg in cases]
+
+    print(f"Running {len(cases)} cases on {workers} workers x {torch_threads} torch threads")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_grid_worker,
+        initargs=(df, features, base_checkpoint_path, data_key, torch_threads),
+    ) as pool:
+        results = []
+        for cfg, loss, collected in pool.map(_run_grid_case, cases):
+            instrumentation.merge(collected)
+            results.append((cfg, loss))
+        return results
+
+
+def split_holdout(X_tensor, y_tensor, seq_len, horizon):
+    # The oldest windows of the day are held out, so the newest data is always
+    # trained on. A gap of seq_len + horizon windows keeps the holdout's inputs
+    # and targets out of the training windows.
+    n_hold = max(1, int(len(X_tensor) * HOLDOUT_FRACTION))
+    gap = seq_len + (max(horizon) if isinstance(horizon, (list, tuple)) else horizon)
+    if len(X_tensor) - n_hold - gap <= 0:
+        return (X_tensor, y_tensor), (None, None)
+    return (X_tensor[n_hold + gap:], y_tensor[n_hold + gap:]), (X_tensor[:n_hold], y_tensor[:n_hold])
+
+
+def evaluate_loss(model, loss_fn, X, y):
+    model.eval()
+    with torch.no_grad():
+        loss = loss_fn(model(X), y).item()
+    model.train()
+    return loss
+
+
+def halving_milestones(epochs, min_epochs=SH_MIN_EPOCHS, eta=SH_ETA):
+    rungs = []
+    e = min_epochs
+    while e < max(epochs):
+        rungs.append(e)
+        e *= eta
+    return sorted(set(rungs) | set(epochs)), set(rungs)
+
+
+def prune_rung(live, min_survivors=SH_MIN_SURVIVORS, eta=SH_ETA):
+    # Ranks lineages only against those with the same (seq_len, horizon):
+    # holdout losses of different horizons are not comparable. Returns
+    # (survivors, pruned).
+    brackets = {}
+    for lineage in live:
+        key = (lineage["cfg"]["seq_len"], horizon_tag(lineage["cfg"]["horizon"]))
+        brackets.setdefault(key, []).append(lineage)
+    min_keep = math.ceil(min_survivors / len(brackets))
+    survivors, pruned = [], []
+    for group in brackets.values():
+        group.sort(key=lambda l: l["holdout_loss"])
+        keep = max(min_keep, math.ceil(len(group) / eta))
+        survivors += group[:keep]
+        pruned += group[keep:]
+    return survivors, pruned
+
+
+def train_lineage_segment(df, features, lineage, base_checkpoint_path, data_key):
+    # Continue one lineage from lineage["epoch"] to lineage["target_epoch"],
+    # saving a model for every configured epoch count reached on the way.
+    cfg = lineage["cfg"]
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    checkpoint = load_base_checkpoint(base_checkpoint_path, device)
+    scaler_X = training_scaler(checkpoint, features)
+    X_tensor, y_tensor = get_prepared_dataset(
+        df, data_key, features, cfg["seq_len"], cfg["horizon"], scaler_X, device
+    )
+    if len(X_tensor) == 0:
+        lineage["epoch"] = max(lineage["save_epochs"])
+        return lineage
+    (X_train, y_train), (X_hold, y_hold) = split_holdout(X_tensor, y_tensor, cfg["seq_len"], cfg["horizon"])
+
+    if lineage["state"] is None:
+        model = build_model(
+            len(features), len(TARGETS), cfg["horizon"], checkpoint["state_dict"], checkpoint_horizon(checkpoint)
+        ).to(device)
+        optimizer = make_optimizer(model)
+    else:
+        state = torch.load(io.BytesIO(lineage["state"]), map_location=device, weights_only=False)
+        model = build_model(len(features), len(TARGETS), cfg["horizon"], state["model"]).to(device)
+        optimizer = make_optimizer(model)
+        optimizer.load_state_dict(state["optimizer"])
+    loss_fn = nn.MSELoss()
+    replay, n_replay = replay_sampler(features, cfg, scaler_X, len(X_train), data_key)
+    run_epoch = epoch_runner(model, optimizer, loss_fn, X_train, y_train, cfg["batch_size"], replay=replay)
+    n_samples = len(X_train) + n_replay
+
+    loss_values = lineage["loss_values"]
+    model.train()
+    for ep in range(lineage["epoch"], lineage["target_epoch"]):
+        start = time.perf_counter()
+        epoch_loss = run_epoch()
+        seconds = time.perf_counter() - start
+        instrumentation.record_epoch(lineage["name"], ep + 1, n_samples, seconds)
+        loss_values.append(epoch_loss)
+        if (ep + 1) % 5 == 0:
+            print(
+                f"[{lineage['name']}] Epoch {ep+1}/{max(lineage['save_epochs'])} | Loss: {epoch_loss:.4f}"
+                f" | {n_samples / seconds:.0f} samples/s"
+            )
 
-        mlflow.log_metric("mse_inc", epoch_loss)
-        
-        os.makedirs(INC_MODEL_DIR, exist_ok=True)
-        save_path = f"{INC_MODEL_DIR}/{name}.pth"
-        
-        torch.save({
-            "state_dict": model.state_dict(),
-            "features": features,
-            "targets": TARGETS,
-            "seq_len": cfg["seq_len"],
-            "horizon": cfg["horizon"],
-            "scaler_mean": scaler_X.mean_.tolist(),
-            "scaler_scale": scaler_X.scale_.tolist(),
-            "config": cfg,
-        }, save_path)
-
-        avg_last = np.mean(loss_values[-5:]) if len(loss_values) >= 5 else np.mean(loss_values)
-        return avg_last
+        if ep + 1 in lineage["save_epochs"]:
+            case_cfg = dict(cfg, epochs=ep + 1)
+            avg_last = average_last_losses(loss_values)
+            save_incremental_model(model, features, case_cfg, scaler_X)
+            holdout = evaluate_loss(model, loss_fn, X_hold, y_hold) if X_hold is not None else None
+
+            with tracking.start_run(EXPERIMENT_NAME, f"Inc_{case_name(case_cfg)}") as run:
+                run.log_params(case_cfg)
+                # The lineage's losses so far are this case's training curve.
+                run.log_curve("loss", loss_values)
+                run.log_metric("mse_inc", epoch_loss)
+                if holdout is not None:
+                    run.log_metric("mse_holdout", holdout)
+            lineage["results"].append((case_cfg, avg_last))
+
+    lineage["epoch"] = lineage["target_epoch"]
+    lineage["holdout_loss"] = (
+        evaluate_loss(model, loss_fn, X_hold, y_hold) if X_hold is not None else average_last_losses(loss_values)
+    )
+    buf = io.BytesIO()
+    torch.save({"model": model.state_dict(), "optimizer": optimizer.state_dict()}, buf)
+    lineage["state"] = buf.getvalue()
+    return lineage
+
+
+def _run_lineage_segment(lineage):
+    state = _WORKER_STATE
+    lineage = train_lineage_segment(
+        state["df"], state["features"], lineage, state["base_checkpoint_path"], state["data_key"]
+    )
+    tracking.flush()
+    lineage["metrics"] = instrumentation.drain()
+    return lineage
+
+
+def run_successive_halving(df, features, cases, base_checkpoint_path, data_key, workers=1, torch_threads=1):
+    # Returns (cfg, loss) pairs for every case that was trained to completion,
+    # in the same order as cases. Pruned configs are missing from the output.
+    if not os.path.exists(base_checkpoint_path):
+        print(f"The original model could not be found at {base_checkpoint_path}. Skipping all cases.")
+        return []
+
+    lineages = {}
+    for cfg in cases:
+        key = (cfg["seq_len"], horizon_tag(cfg["horizon"]), cfg["batch_size"])
+        if key not in lineages:
+            base_cfg = {"seq_len": cfg["seq_len"], "horizon": cfg["horizon"], "batch_size": cfg["batch_size"]}
+            lineages[key] = {
+                "name": f"h{horizon_tag(cfg['horizon'])}_bs{cfg['batch_size']}",
+                "cfg": base_cfg,
+                "save_epochs": [],
+                "epoch": 0,
+                "target_epoch": 0,
+                "state": None,
+                "loss_values": [],
+                "results": [],
+                "holdout_loss": None,
+            }
+        lineages[key]["save_epochs"].append(cfg["epochs"])
+
+    milestones, rungs = halving_milestones(sorted({cfg["epochs"] for cfg in cases}))
+    live = list(lineages.values())
+    finished = []
+
+    pool = None
+    if workers > 1 and len(live) > 1:
+        print(f"Running {len(live)} lineages on {workers} workers x {torch_threads} torch threads")
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_grid_worker,
+            initargs=(df, features, base_checkpoint_path, data_key, torch_threads),
+        )
+    else:
+        torch.set_num_threads(torch_threads)
 
+    try:
+        for milestone in milestones:
+            if not live:
+                break
+            for lineage in live:
+                lineage["target_epoch"] = min(milestone, max(lineage["save_epochs"]))
+            if pool is not None:
+                live = list(pool.map(_run_lineage_segment, live))
+                for lineage in live:
+                    instrumentation.merge(lineage.pop("metrics"))
+            else:
+                live = [train_lineage_segment(df, features, l, base_checkpoint_path, data_key) for l in live]
+
+            finished += [l for l in live if l["epoch"] >= max(l["save_epochs"])]
+            live = [l for l in live if l["epoch"] < max(l["save_epochs"])]
+
+            if milestone in rungs and live:
+                survivors, pruned = prune_rung(live)
+                print(f"\nRung at epoch {milestone}: keeping {len(survivors)}/{len(live)} lineages")
+                for lineage in pruned:
+                    print(f"Pruned {lineage['name']} | holdout_loss={lineage['holdout_loss']:.4f}")
+                finished += pruned
+                live = survivors
     finally:
-        mlflow.end_run()
+        if pool is not None:
+            pool.shutdown()
+
+    losses = {}
+    for lineage in finished + live:
+        for case_cfg, loss in lineage["results"]:
+            losses[case_name(case_cfg)] = loss
+    return [(cfg, losses[case_name(cfg)]) for cfg in cases if case_name(cfg) in losses]
 
-if __name__ == "__main__":
-    mlflow.set_experiment(EXPERIMENT_NAME)
 
-    daily_dir = "./dataset_daily/"
-    daily_files = sorted(glob.glob(os.path.join(daily_dir, "*.csv")))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GRID_WORKERS", "0")),
+                        help="Number of grid worker processes (0 = one per available core group)")
+    parser.add_argument("--torch-threads", type=int, default=int(os.environ.get("GRID_TORCH_THREADS", "1")),
+                        help="Torch intra-op threads per worker")
+    parser.add_argument("--scheduler", choices=["halving", "grid"], default=os.environ.get("GRID_SCHEDULER", "halving"),
+                        help="halving: resume longer runs from shorter ones and prune on holdout loss; grid: train every case from scratch")
+    parser.add_argument("--multi-horizon", action="store_true", default=MULTI_HORIZON,
+                        help="Train one model predicting all HORIZONS instead of one model per horizon")
+    parser.add_argument("--data", default=os.environ.get("TRAIN_DATA_URI", "./dataset_daily/"),
+                        help="Directory or s3://bucket/prefix holding the daily CSVs; the latest one is used")
+    args = parser.parse_args()
+
+    # Events buffered while the tracking server was down on earlier runs.
+    tracking.replay()
+
+    # An s3:// prefix is read straight from the object store; its ETag stands in for the file hash.
+    if s3io.is_s3_path(args.data):
+        daily_files = s3io.list_objects(args.data)
+    else:
+        daily_files = [(path, None, None) for path in sorted(glob.glob(os.path.join(args.data, "*.csv")))]
     if not daily_files:
-        print("No CSV files were found in dataset_daily.")
+        print(f"No CSV files were found in {args.data}.")
         exit(1)
     
-    latest_csv = daily_files[-1]
+    latest_csv, latest_etag, _ = daily_files[-1]
     print(f"Using new data from: {latest_csv}")
-    df_new = pd.read_csv(latest_csv)
-
     FEATURES = TARGETS.copy()
+    # Training needs the whole day in memory: it is hashed, appended to the
+    # history store, windowed into one tensor per (seq_len, horizon) and split
+    # into holdout and training windows. Only evaluation streams its CSVs.
+    with instrumentation.timed("load_data"):
+        df_new = read_weather_csv(latest_csv, list(dict.fromkeys(FEATURES + TARGETS)))
+        data_key = latest_etag or file_hash(latest_csv)
+    if TRAIN_HISTORY:
+        with instrumentation.timed("history_append"):
+            history = HistoryStore(HISTORY_DIR, list(dict.fromkeys(FEATURES + TARGETS)))
+            history.append(df_new, data_key, os.path.basename(latest_csv))
+
     results = []
     log_lines = [f"Incremental Training Log - {time.ctime()}", f"Data source: {latest_csv}\n"]
 
-    for seq_len, horizon, epochs, batch_size in itertools.product(
-        SEQ_LENS, HORIZONS, EPOCHS, BATCH_SIZES
-    ):
-        cfg = {
+    horizon_grid = [HORIZONS] if args.multi_horizon else HORIZONS
+    cases = [
+        {
             "seq_len": seq_len,
             "horizon": horizon,
             "epochs": epochs,
             "batch_size": batch_size,
         }
+        for seq_len, horizon, epochs, batch_size in itertools.product(
+            SEQ_LENS, horizon_grid, EPOCHS, BATCH_SIZES
+        )
+    ]
 
-        base_model_path = f"current_model/model.pth" 
-        #base_model_path = f"models/h{horizon}_ep{epochs}_bs{batch_size}.pth"
+    base_model_path = f"current_model/model.pth" 
+    #base_model_path = f"models/h{horizon}_ep{epochs}_bs{batch_size}.pth"
 
-        loss = train_incremental_case(df_new, FEATURES, cfg, base_model_path)
+    torch_threads = max(1, args.torch_threads)
+    workers = args.workers or default_grid_workers(len(cases), torch_threads)
+
+    run_cases = run_successive_halving if args.scheduler == "halving" else run_grid
+    with instrumentation.timed(f"train_{args.scheduler}"):
+        case_results = run_cases(df_new, FEATURES, cases, base_model_path, data_key, workers, torch_threads)
+    for cfg, loss in case_results:
+        seq_len, horizon, epochs, batch_size = cfg["seq_len"], cfg["horizon"], cfg["epochs"], cfg["batch_size"]
 
         if loss is not None:
-            model_name = f"h{horizon}_ep{epochs}_bs{batch_size}.pth"
+            model_name = f"{case_name(cfg)}{CHECKPOINT_EXT}"
             results.append({"model_name": model_name, "loss": loss})
             
             line = f"seq_len={seq_len}, horizon={horizon}, epochs={epochs}, batch_size={batch_size}, final_loss={loss:.4f}"
@@ -205,4 +654,6 @@ if __name__ == "__main__":
                 os.path.join(INC_MODEL_DIR, item["model_name"]),
                 os.path.join("top3_models_incremental", item["model_name"])
             )
-        print(f"\n Completed! Models saved at {INC_MODEL_DIR} and Top 3 at top3_models_incremental")
\ No newline at end of file
+        print(f"\n Completed! Models saved at {INC_MODEL_DIR} and Top 3 at top3_models_incremental")
+
+    instrumentation.flush("train_incremental")
\ No newline at end of file
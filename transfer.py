@@ -0,0 +1,100 @@
+import os
+import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+TRANSFER_WORKERS = int(os.environ.get("TRANSFER_WORKERS", "8"))
+# Attempts per object, the first one included; 0 or less means a single attempt.
+TRANSFER_RETRIES = max(1, int(os.environ.get("TRANSFER_RETRIES", "4")))
+RETRY_BASE_DELAY = 0.5
+
+MiB = 1024 * 1024
+MULTIPART_THRESHOLD = 64 * MiB
+MIN_PART_SIZE = 8 * MiB
+MAX_PARTS = 1000
+
+
+def part_size_for(size):
+    # Small objects go in one request. Large ones are split into at most
+    # MAX_PARTS parts, rounded up to whole MiB and never below MIN_PART_SIZE
+    # (S3 rejects parts under 5 MiB).
+    if size <= MULTIPART_THRESHOLD:
+        return size
+    return max(MIN_PART_SIZE, math.ceil(size / MAX_PARTS / MiB) * MiB)
+
+
+def part_ranges(size, part_size):
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+
+class TransferStats:
+    def __init__(self, label):
+        self.label = label
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.retries = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, nbytes=0, ok=True, retries=0):
+        with self._lock:
+            if ok:
+                self.files += 1
+                self.bytes += nbytes
+            else:
+                self.failed += 1
+            self.retries += retries
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        elapsed = self.elapsed()
+        mb = self.bytes / MiB
+        rate = mb / elapsed if elapsed > 0 else 0.0
+        print(
+            f"[transfer] {self.label}: {self.files} files, {mb:.1f} MB in {elapsed:.2f}s "
+            f"({rate:.1f} MB/s), {self.failed} failed, {self.retries} retries"
+        )
+
+
+def with_retries(fn, *args, attempts=TRANSFER_RETRIES, base_delay=RETRY_BASE_DELAY, label=""):
+    # Returns (result, retries_used). Re-raises the last error once attempts run
+    # out; fn is always called at least once.
+    attempts = max(1, attempts)
+    for attempt in range(attempts):
+        try:
+            return fn(*args), attempt
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            print(f"[transfer] {label} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run_transfers(tasks, transfer_fn, stats, workers=TRANSFER_WORKERS):
+    # tasks are (label, args) tuples; transfer_fn(*args) moves one object and
+    # returns the number of bytes it sent or received. Returns the failed labels.
+    failed = []
+
+    def run(task):
+        label, args = task
+        try:
+            nbytes, retries = with_retries(transfer_fn, *args, label=label)
+        except Exception as e:
+            print(f"[transfer] {label} gave up: {e}")
+            stats.record(ok=False, retries=TRANSFER_RETRIES - 1)
+            return label
+        stats.record(nbytes or 0, retries=retries)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for future in as_completed([pool.submit(run, task) for task in tasks]):
+            label = future.result()
+            if label is not None:
+                failed.append(label)
+    return failed
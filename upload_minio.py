@@ -1,58 +1,262 @@
 import os
+import json
+import hashlib
+import argparse
+import threading
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
 from datetime import datetime
+import instrumentation
+from transfer import (
+    TRANSFER_WORKERS, MULTIPART_THRESHOLD, TransferStats, part_size_for, run_transfers, with_retries
+)
 
 
-MINIO_URL = "https://minio.neikoscloud.net" 
+MINIO_URL = "https://minio.neikoscloud.net"
 ACCESS_KEY = "admin"
 SECRET_KEY = "admin123"
 BUCKET_NAME = "devopsproject"
 BASE_PATH = "data_all_train"
+PART_WORKERS = 4
+
+# Sync mode stores each distinct file once under OBJECTS_PREFIX, keyed by its
+# SHA-256, and every run only writes a manifest pointing at those objects.
+OBJECTS_PREFIX = f"{BASE_PATH}/objects"
+LATEST_MANIFEST = f"{BASE_PATH}/latest_manifest.json"
+FOLDERS_TO_UPLOAD = ['top3_models_incremental', 'models_incremental', 'best_model_final', 'evaluation_logs', 'dataset_test', 'test_logs']
+PROD_MODEL_LOCAL = "best_model_final/weather_model_production.pth"
+STATIC_S3_PATH = "current_model/model.pth"
+# Written by export_model.py; names the artifact (float or int8) to serve.
+SERVING_INFO_LOCAL = "best_model_final/serving.json"
+STATIC_SERVING_INFO = "current_model/serving.json"
+# history_store.py directory, mirrored as-is: shards never change once written.
+HISTORY_LOCAL = "history_store"
+HISTORY_PREFIX = "history_store"
 
 
+# One client (and connection pool) shared by all upload threads.
 s3_client = boto3.client(
     's3',
     endpoint_url=MINIO_URL,
     aws_access_key_id=ACCESS_KEY,
-    aws_secret_access_key=SECRET_KEY
+    aws_secret_access_key=SECRET_KEY,
+    config=Config(
+        max_pool_connections=TRANSFER_WORKERS * PART_WORKERS,
+        retries={"max_attempts": 3, "mode": "standard"},
+    ),
 )
 
-def upload_folders_to_minio():
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    folders_to_upload = ['top3_models_incremental', 'models_incremental', 'best_model_final', 'evaluation_logs', 'dataset_test', 'test_logs']
-    prod_model_local = "best_model_final/weather_model_production.pth"
-    static_s3_path = "current_model/model.pth"
-    
-    print(f"--- Start uploading the link: {BASE_PATH}/{timestamp} ---")
+def upload_object(local_path, s3_path):
+    size = os.path.getsize(local_path)
+    config = TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=max(part_size_for(size), 5 * 1024 * 1024),
+        max_concurrency=PART_WORKERS,
+    )
+    s3_client.upload_file(local_path, BUCKET_NAME, s3_path, Config=config)
+    print(f"Uploaded: {local_path} -> {s3_path}")
+    return size
 
-    for folder in folders_to_upload:
+def list_local_files(folders=FOLDERS_TO_UPLOAD):
+    local_files = []
+    for folder in folders:
         if not os.path.isdir(folder):
             print(f"Warning: Folder {folder} not found, skipping...")
             continue
-            
+
         for root, dirs, files in os.walk(folder):
             for file in files:
-                local_path = os.path.join(root, file)
-                
-                s3_path = f"{BASE_PATH}/{timestamp}/{local_path}".replace("\\", "/")
-                
-                try:
-                    s3_client.upload_file(local_path, BUCKET_NAME, s3_path)
-                    print(f"Uploaded: {local_path} -> {s3_path}")
-                except Exception as e:
-                    print(f"Lỗi khi upload {local_path}: {e}")
-
-        if os.path.exists(prod_model_local):
-            print(f"\n--- Updating the production model now: {static_s3_path} ---")
-            try:
-                s3_client.upload_file(prod_model_local, BUCKET_NAME, static_s3_path)
-                print(f"Success: Overwritten {prod_model_local} -> {static_s3_path}")
-            except Exception as e:
-                print(f"Error overwriting current model: {e}")
-        else:
-            print(f"Warning: {prod_model_local} not found to update current version.")
+                local_files.append(os.path.join(root, file).replace("\\", "/"))
+    return sorted(local_files)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def object_key(sha256):
+    return f"{OBJECTS_PREFIX}/{sha256[:2]}/{sha256}"
+
+def manifest_key(run):
+    return LATEST_MANIFEST if run == "latest" else f"{BASE_PATH}/{run}/manifest.json"
+
+def load_manifest(key):
+    try:
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(body)
+
+def object_exists(key):
+    try:
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound"):
+            return False
+        raise
+
+def upload_folders_to_minio(workers=TRANSFER_WORKERS):
+    # Full copy of every file under a fresh timestamped prefix.
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    print(f"--- Start uploading the link: {BASE_PATH}/{timestamp} ---")
+
+    tasks = []
+    for local_path in list_local_files():
+        s3_path = f"{BASE_PATH}/{timestamp}/{local_path}"
+        tasks.append((local_path, (local_path, s3_path)))
+
+    stats = TransferStats(f"upload {BASE_PATH}/{timestamp}")
+    with instrumentation.timed("upload_objects"):
+        failed = run_transfers(tasks, upload_object, stats, workers)
+    for local_path in failed:
+        print(f"Lỗi khi upload {local_path}")
+    stats.report()
+
+    update_production_model()
     print("--- Upload pipeline completed ---")
 
+def sync_folders_to_minio(workers=TRANSFER_WORKERS):
+    # Uploads only content the bucket does not already hold, then writes
+    # <BASE_PATH>/<timestamp>/manifest.json mapping each local path to its object.
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    print(f"--- Start syncing the link: {BASE_PATH}/{timestamp} ---")
+
+    previous = load_manifest(LATEST_MANIFEST) or {"files": {}}
+    known_keys = {entry["key"] for entry in previous["files"].values()}
+
+    files = {}
+    with instrumentation.timed("hash_local_files"):
+        for local_path in list_local_files():
+            sha256 = file_sha256(local_path)
+            files[local_path] = {"sha256": sha256, "size": os.path.getsize(local_path), "key": object_key(sha256)}
+
+    reused = []
+    reused_lock = threading.Lock()
+
+    def sync_object(local_path, key):
+        if key in known_keys or object_exists(key):
+            with reused_lock:
+                reused.append(local_path)
+            return 0
+        return upload_object(local_path, key)
+
+    # Identical files inside one run share an object, so each key is uploaded once.
+    tasks = {}
+    for local_path, entry in files.items():
+        tasks.setdefault(entry["key"], (local_path, (local_path, entry["key"])))
+
+    stats = TransferStats(f"sync {BASE_PATH}/{timestamp}")
+    with instrumentation.timed("upload_objects"):
+        failed = set(run_transfers(list(tasks.values()), sync_object, stats, workers))
+    for local_path in failed:
+        print(f"Lỗi khi upload {local_path}")
+    stats.report()
+    print(f"Unchanged files reused: {len(reused)}/{len(tasks)} objects")
+
+    failed_keys = {files[p]["key"] for p in failed}
+    manifest = {
+        "run": timestamp,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "files": {p: e for p, e in files.items() if e["key"] not in failed_keys},
+    }
+    body = json.dumps(manifest, indent=1).encode("utf-8")
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=manifest_key(timestamp), Body=body)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=LATEST_MANIFEST, Body=body)
+    print(f"Manifest written: {manifest_key(timestamp)} ({len(manifest['files'])} files)")
+
+    update_production_model(manifest)
+    print("--- Upload pipeline completed ---")
+    return manifest
+
+def publish_file(local_path, s3_path, manifest=None):
+    entry = (manifest or {}).get("files", {}).get(local_path)
+    if entry:
+        # Already stored by the sync; copy it server-side instead of uploading again.
+        s3_client.copy_object(
+            Bucket=BUCKET_NAME, Key=s3_path, CopySource={"Bucket": BUCKET_NAME, "Key": entry["key"]}
+        )
+    else:
+        with_retries(upload_object, local_path, s3_path, label=s3_path)
+
+def update_production_model(manifest=None):
+    if not os.path.exists(PROD_MODEL_LOCAL):
+        print(f"Warning: {PROD_MODEL_LOCAL} not found to update current version.")
+        return
+
+    print(f"\n--- Updating the production model now: {STATIC_S3_PATH} ---")
+    try:
+        publish_file(PROD_MODEL_LOCAL, STATIC_S3_PATH, manifest)
+        print(f"Success: Overwritten {PROD_MODEL_LOCAL} -> {STATIC_S3_PATH}")
+    except Exception as e:
+        print(f"Error overwriting current model: {e}")
+        return
+    update_serving_artifact(manifest)
+
+def update_serving_artifact(manifest=None):
+    # current_model/serving.json points a runtime started on current_model/ at
+    # the artifact export_model.py accepted: model.pth or the int8 model.
+    if not os.path.exists(SERVING_INFO_LOCAL):
+        return
+    with open(SERVING_INFO_LOCAL, "r", encoding="utf-8") as f:
+        info = json.load(f)
+
+    static_dir = os.path.dirname(STATIC_S3_PATH)
+    artifact_local = os.path.join(os.path.dirname(SERVING_INFO_LOCAL), info["artifact"]).replace("\\", "/")
+    try:
+        if artifact_local == PROD_MODEL_LOCAL:
+            info["artifact"] = os.path.basename(STATIC_S3_PATH)
+        else:
+            publish_file(artifact_local, f"{static_dir}/{info['artifact']}", manifest)
+        body = json.dumps(info, indent=1).encode("utf-8")
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=STATIC_SERVING_INFO, Body=body)
+        print(f"Success: Serving artifact {static_dir}/{info['artifact']}")
+    except Exception as e:
+        print(f"Error updating serving artifact: {e}")
+
+def sync_history_store(workers=TRANSFER_WORKERS):
+    # New shards first and the manifest last, so a reader never sees a
+    # manifest naming a shard that is not in the bucket yet.
+    manifest_path = os.path.join(HISTORY_LOCAL, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        shards = json.load(f)["shards"]
+
+    def sync_shard(local_path, key):
+        return 0 if object_exists(key) else upload_object(local_path, key)
+
+    tasks = [
+        (s["file"], (os.path.join(HISTORY_LOCAL, s["file"]), f"{HISTORY_PREFIX}/{s['file']}")) for s in shards
+    ]
+    stats = TransferStats(f"sync {HISTORY_PREFIX}")
+    with instrumentation.timed("upload_history"):
+        failed = run_transfers(tasks, sync_shard, stats, workers)
+    stats.report()
+    if failed:
+        print(f"Lỗi khi upload {HISTORY_PREFIX}: {failed}; manifest not updated")
+        return
+    with_retries(upload_object, manifest_path, f"{HISTORY_PREFIX}/manifest.json", label=manifest_path)
+
 if __name__ == "__main__":
-    upload_folders_to_minio()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["sync", "full"], default=os.environ.get("UPLOAD_MODE", "sync"),
+                        help="sync: upload only changed files and write a manifest; full: copy every file")
+    args = parser.parse_args()
+
+    try:
+        with instrumentation.timed(f"upload_{args.mode}_total"):
+            if args.mode == "full":
+                upload_folders_to_minio()
+            else:
+                sync_folders_to_minio()
+            sync_history_store()
+    finally:
+        instrumentation.flush("upload_minio")
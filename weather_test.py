@@ -5,110 +5,220 @@ import os
 import sys
 import argparse
 from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import mean_absolute_error, mean_squared_error
+from windowing import create_sequences
+from ingest import iter_chunks, iter_sequences, peak_rss_mb, shifted_targets
+from metrics import regression_metrics, metrics_row
+from checkpoint import MODEL_EXTS, load_checkpoint
+from tcn import TCN, StackedTCN, build_model, horizon_tag, input_columns
 
 MODEL_DIR = "top3_models_incremental"
 LOG_DIR = "test_logs"
+RESULT_FORMATS = ["csv", "parquet"]
+EVAL_CHUNK_ROWS = 20_000
+# Candidates sharing features, seq_len, horizon and scaler are scored together:
+# one set of windows and one StackedTCN pass per group (EVAL_FUSED=0: per model).
+EVAL_FUSED = os.environ.get("EVAL_FUSED", "1") == "1"
 
 TARGETS = [
     "temperature", "feels_like", "humidity", "wind_speed", "gust_speed", "pressure", "precipitation",
     "rain_probability", "snow_probability", "uv_index", "dewpoint", "visibility", "cloud"
 ]
 
-class TCN(torch.nn.Module):
-    def __init__(self, num_inputs, num_outputs):
-        super().__init__()
-        self.net = torch.nn.Sequential(
-            torch.nn.Conv1d(num_inputs, 32, 3, padding=2, dilation=1),
-            torch.nn.ReLU(),
-            torch.nn.Conv1d(32, 64, 3, padding=4, dilation=2),
-            torch.nn.ReLU(),
-        )
-        self.fc = torch.nn.Linear(64, num_outputs)
-    def forward(self, x):
-        x = x.permute(0, 2, 1)
-        y = self.net(x)
-        return self.fc(y[:, :, -1])
-
-def prepare_data(df, features, targets, horizon, seq_len, scaler_X):
-    df = df.copy()
-    for t in targets:
-        df[f"{t}_y"] = df[t].shift(-horizon)
-    df.dropna(inplace=True)
-    X = scaler_X.transform(df[features].values)
-    y = df[[f"{t}_y" for t in targets]].values
-    
-    xs, ys = [], []
-    for i in range(len(X) - seq_len):
-        xs.append(X[i:i + seq_len])
-        ys.append(y[i + seq_len - 1])
-    return np.array(xs), np.array(ys)
+def prepare_data(df, features, targets, horizon, seq_len, scaler_X, return_persistence=False):
+    X_raw, y, y_current = shifted_targets(df, features, targets, horizon)
+    X = scaler_X.transform(X_raw)
+    X_seq, y_seq = create_sequences(X, y, seq_len)
+    if not return_persistence:
+        return X_seq, y_seq
+    # Persistence baseline: the last observed value in each window, aligned with y_seq.
+    _, y_persist = create_sequences(X, y_current, seq_len)
+    return X_seq, y_seq, y_persist
 
-def test_one_model(model_path, df_test):
-    checkpoint = torch.load(model_path, weights_only=False)
+def load_model(model_path):
+    checkpoint = load_checkpoint(model_path)
     
     cfg = checkpoint["config"]
     features = checkpoint["features"]
     targets = checkpoint["targets"]
-    seq_len = cfg["seq_len"]
-    horizon = cfg["horizon"]
     if "scaler_X" in checkpoint:
         scaler_X = checkpoint["scaler_X"]
     else:
-        from sklearn.preprocessing import StandardScaler
         scaler_X = StandardScaler()
         scaler_X.mean_ = np.array(checkpoint["scaler_mean"])
         scaler_X.scale_ = np.array(checkpoint["scaler_scale"])
         scaler_X.n_features_in_ = len(features)
-    X_test, y_test = prepare_data(df_test, features, targets, horizon, seq_len, scaler_X)
-    
-    if len(X_test) == 0:
-        return None, None, None, horizon
 
-    model = TCN(len(features), len(targets))
-    model.load_state_dict(checkpoint["state_dict"])
+    model = build_model(len(features), len(targets), cfg["horizon"], checkpoint["state_dict"])
     model.eval()
 
-    with torch.no_grad():
-        X_test_t = torch.tensor(X_test, dtype=torch.float32)
-        preds = model(X_test_t).numpy()
+    return {
+        "name": os.path.basename(model_path),
+        "model": model,
+        "features": features,
+        "targets": targets,
+        "seq_len": cfg["seq_len"],
+        "horizon": cfg["horizon"],
+        "scaler_X": scaler_X,
+    }
+
+def load_models(model_dir=MODEL_DIR):
+    model_files = [f for f in os.listdir(model_dir) if f.endswith(MODEL_EXTS)]
+    return [load_model(os.path.join(model_dir, m_name)) for m_name in model_files]
+
+def group_key(loaded):
+    scaler = loaded["scaler_X"]
+    return (
+        tuple(loaded["features"]), tuple(loaded["targets"]), loaded["seq_len"], horizon_tag(loaded["horizon"]),
+        np.asarray(scaler.mean_, dtype=np.float64).tobytes(), np.asarray(scaler.scale_, dtype=np.float64).tobytes(),
+    )
+
+def fuse_models(models):
+    # Each group of two or more models becomes one entry whose "model" is a
+    # StackedTCN and whose "members" lists the model names in stacking order.
+    groups = {}
+    for loaded in models:
+        groups.setdefault(group_key(loaded), []).append(loaded)
+    fused = []
+    for members in groups.values():
+        if len(members) == 1:
+            fused.extend(members)
+            continue
+        try:
+            stacked = StackedTCN([m["model"] for m in members], members[0]["seq_len"]).eval()
+        except ValueError as e:
+            print(f"Cannot fuse {[m['name'] for m in members]}: {e}")
+            fused.extend(members)
+            continue
+        fused.append(dict(members[0], name="+".join(m["name"] for m in members), model=stacked,
+                          members=[m["name"] for m in members]))
+    return fused
+
+def predict_windows(loaded, df_test, chunksize=EVAL_CHUNK_ROWS):
+    # Windows are built and scored one row chunk at a time, so only one chunk
+    # of (windows x seq_len x features) is ever materialized as a tensor.
+    # df_test may also be a CSV path, which is then streamed from disk or S3.
+    # Returns (preds, y_true, y_persistence), or None when no window fits; for
+    # a multi-horizon model preds and y_true are (windows, horizons, targets),
+    # and a fused group adds a leading members axis to preds.
+    targets = loaded["targets"]
+    horizon = loaded["horizon"]
+    # Only the newest steps reach the output (see tcn.input_columns); other
+    # modules (e.g. export_model.py's int8 model) get whole windows.
+    steps = loaded["seq_len"]
+    if isinstance(loaded["model"], (TCN, StackedTCN)):
+        steps = input_columns(loaded["model"], steps)
+    preds, ys, persists = [], [], []
+    chunks = iter_chunks(df_test, list(dict.fromkeys(loaded["features"] + targets)), chunksize)
+    for X_seq, y_seq, y_cur in iter_sequences(
+        chunks, loaded["features"], targets, horizon, loaded["seq_len"], loaded["scaler_X"]
+    ):
+        with torch.no_grad():
+            preds.append(loaded["model"](torch.tensor(X_seq[:, -steps:], dtype=torch.float32)).numpy())
+        ys.append(y_seq)
+        persists.append(y_cur)
     
-    mae = mean_absolute_error(y_test, preds)
-    rmse = np.sqrt(mean_squared_error(y_test, preds))
+    if not preds:
+        return None
+    axis = 1 if "members" in loaded else 0
+    return np.concatenate(preds, axis=axis), np.concatenate(ys), np.concatenate(persists)
+
+def _score(targets, preds, y_test, y_persist, horizon):
+    metrics = regression_metrics(y_test, preds, y_persist)
     
     out_detail = {}
     for i, t in enumerate(targets):
         out_detail[f"{t}_true"] = y_test[:, i]
         out_detail[f"{t}_pred"] = preds[:, i]
         
-    return out_detail, mae, rmse, horizon
+    return out_detail, metrics, horizon
+
+def _score_horizons(targets, horizon, preds, y_test, y_persist):
+    if not isinstance(horizon, (list, tuple)):
+        return [_score(targets, preds, y_test, y_persist, horizon)]
+    return [
+        _score(targets, preds[:, i], y_test[:, i], y_persist, h)
+        for i, h in enumerate(horizon)
+    ]
+
+def score_horizons(loaded, df_test, chunksize=EVAL_CHUNK_ROWS):
+    # One (detail, metrics, horizon) per horizon the model predicts, from a
+    # single forward pass per window.
+    scored = predict_windows(loaded, df_test, chunksize)
+    if scored is None:
+        return []
+    return _score_horizons(loaded["targets"], loaded["horizon"], *scored)
+
+def score_members(loaded, df_test, chunksize=EVAL_CHUNK_ROWS):
+    # (name, score_horizons result) for a model or for every member of a fused group.
+    if "members" not in loaded:
+        return [(loaded["name"], score_horizons(loaded, df_test, chunksize))]
+    scored = predict_windows(loaded, df_test, chunksize)
+    if scored is None:
+        return [(name, []) for name in loaded["members"]]
+    preds, y_test, y_persist = scored
+    return [
+        (name, _score_horizons(loaded["targets"], loaded["horizon"], preds[i], y_test, y_persist))
+        for i, name in enumerate(loaded["members"])
+    ]
+
+def score_model(loaded, df_test, chunksize=EVAL_CHUNK_ROWS):
+    # First horizon only for multi-horizon models; see score_horizons.
+    scored = score_horizons(loaded, df_test, chunksize)
+    if not scored:
+        return None, None, loaded["horizon"]
+    return scored[0]
+
+def test_one_model(model_path, df_test):
+    detail, metrics, horizon = score_model(load_model(model_path), df_test)
+    if detail is None:
+        return None, None, None, horizon
+    return detail, metrics["mae"], metrics["rmse"], horizon
+
+def result_frame(name, detail, mae, rmse, horizon):
+    # One column per array; model/horizon/mae/rmse are broadcast over the samples.
+    return pd.DataFrame({"model": name, "horizon": horizon, "mae": mae, "rmse": rmse, **detail})
+
+def write_result(result_df, out_name, log_dir=LOG_DIR, fmt="csv"):
+    if fmt == "parquet":
+        out_path = os.path.join(log_dir, f"{out_name}_result.parquet")
+        result_df.to_parquet(out_path, index=False)
+    else:
+        out_path = os.path.join(log_dir, f"{out_name}_result.csv")
+        result_df.to_csv(out_path, index=False)
+    return out_path
+
+def read_result(path, columns=None):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+def evaluate_dataset(models, data_path, out_name, log_dir=LOG_DIR, fmt="csv", fused=EVAL_FUSED):
+    # Returns (result_path, metrics_path), or (None, None) when no model could be scored.
+    # The CSV is streamed once per model (or fused group) rather than loaded whole.
+    frames = []
+    metric_rows = []
+    for loaded in (fuse_models(models) if fused else models):
+        for name, scored in score_members(loaded, data_path):
+            for detail, metrics, horizon in scored:
+                frames.append(result_frame(name, detail, metrics["mae"], metrics["rmse"], horizon))
+                metric_rows.append({"model": name, "horizon": horizon, **metrics_row(metrics, loaded["targets"])})
+
+    if not frames:
+        return None, None
+    result_df = pd.concat(frames, ignore_index=True)
+    out_path = write_result(result_df, out_name, log_dir, fmt)
+    metrics_path = os.path.join(log_dir, f"{out_name}_metrics.csv")
+    pd.DataFrame(metric_rows).to_csv(metrics_path, index=False)
+    print(f"Testing completed for {len(models)} models. Results saved at: {out_path}")
+    print(f"[ingest] {os.path.basename(data_path)}: streamed, peak RSS {peak_rss_mb():.0f} MB")
+    return out_path, metrics_path
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, required=True, help="Đường dẫn file CSV test")
     parser.add_argument("--out_name", type=str, required=True, help="Tên file log đầu ra (ví dụ: case_1)")
+    parser.add_argument("--format", choices=RESULT_FORMATS, default="csv", help="Định dạng file kết quả")
     args = parser.parse_args()
 
     os.makedirs(LOG_DIR, exist_ok=True)
-    df_test = pd.read_csv(args.data)
-    
-    model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith(".pth")]
-    
-    all_rows = []
-    for m_name in model_files:
-        path = os.path.join(MODEL_DIR, m_name)
-        detail, mae, rmse, horizon = test_one_model(path, df_test)
-        
-        if detail:
-            n_samples = len(next(iter(detail.values())))
-            for i in range(n_samples):
-                row = {"model": m_name, "horizon": horizon, "mae": mae, "rmse": rmse}
-                for k, v in detail.items():
-                    row[k] = v[i]
-                all_rows.append(row)
-
-    if all_rows:
-        result_df = pd.DataFrame(all_rows)
-        out_path = os.path.join(LOG_DIR, f"{args.out_name}_result.csv")
-        result_df.to_csv(out_path, index=False)
-        print(f"Testing completed for {len(model_files)} models. Results saved at: {out_path}")
\ No newline at end of file
+    evaluate_dataset(load_models(), args.data, args.out_name, fmt=args.format)
\ No newline at end of file
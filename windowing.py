@@ -0,0 +1,30 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def target_rows(n_rows, seq_len):
+    # Row of y paired with each window: the last step of window i is row i + seq_len - 1.
+    # The final window is dropped to keep the historical len(X) - seq_len sample count.
+    n_windows = max(n_rows - seq_len, 0)
+    return np.arange(seq_len - 1, seq_len - 1 + n_windows)
+
+
+def sliding_windows(X, seq_len):
+    # Read-only (n_windows, seq_len, n_features) view over X, no data is copied.
+    X = np.asarray(X)
+    n_windows = max(len(X) - seq_len, 0)
+    if n_windows == 0:
+        return np.empty((0, seq_len) + X.shape[1:], dtype=X.dtype)
+    windows = sliding_window_view(X, seq_len, axis=0)
+    return np.moveaxis(windows, -1, 1)[:n_windows]
+
+
+def create_sequences(X, y, seq_len):
+    X_seq = sliding_windows(X, seq_len)
+    rows = target_rows(len(X), seq_len)
+    y = np.asarray(y)
+    if len(rows) == 0:
+        return X_seq, np.empty((0,) + y.shape[1:], dtype=y.dtype)
+    y_seq = y[rows[0]:rows[-1] + 1]
+    y_seq.flags.writeable = False
+    return X_seq, y_seq